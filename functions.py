@@ -2,13 +2,35 @@
 # IMPORT PACKAGE
 # ==============================
 import pandas as pd, numpy as np
+import os, time, json, threading, queue, pickle, hashlib, bisect
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from statsmodels.tsa.api import VAR
+try:
+	# optional: JIT compiled kernel of the 'fast' spillovers backend
+	from numba import njit
+except ImportError:
+	njit = None
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 # ==============================
 # IMPORT DATA
 # ==============================
+def readSectorData(sector,folder='DailyPrices\\'):
+	df = pd.read_csv(folder+sector+'.JK_D.csv') \
+		.assign(Date=lambda x: pd.to_datetime(x.Date, format="%d-%m-%Y")) \
+		.set_index("Date")
+	return df
+
+def readSectorsData(sectors,folder='DailyPrices\\',maxWorkers=8):
+	# sectors is a list of sector names, each one is read from folder+sector+'.JK_D.csv'
+	# the files are read concurrently, so on network storage the latency of each file overlaps with the others
+	with ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+		dfs = list(executor.map(lambda sector: readSectorData(sector,folder),sectors))
+	sectorsData = dict(zip(sectors,dfs))
+	return sectorsData
+
 def calcMarketDays(sectorData,marketDaysYearEnd=None):
 	# sectorData is a dataframes of data for a sector/market
 	# example: sectorData = pd.Dataframe(columns=['Open','High','Low','Close'])
@@ -28,6 +50,114 @@ def getWithRollingWindow(sectorData,dateFrom,dateTo,rollingWindow=200):
 	sectorData = pd.concat([(sectorData.loc[:dateFrom]).iloc[-rollingWindow:],sectorData.loc[dateFrom:dateTo]])
 	return sectorData
 
+# ==============================
+# INTRADAY INGESTION
+# ==============================
+def calcIntradayChunkAggregates(chunk,carry):
+	# chunk is a dataframe of intraday ticks/bars, sorted by time
+	# example: chunk = pd.Dataframe(columns=['DateTime','Price']) or pd.Dataframe(columns=['DateTime','Open','High','Low','Close'])
+	# carry is the (day, ln price, abs return) of the last row of the previous chunk, so the returns continue across chunks
+	# overnight returns are excluded, the first return of a day is the second observation of the day
+	priceColumn = 'Close' if 'Close' in chunk else 'Price'
+	day = pd.to_datetime(chunk['DateTime']).dt.normalize().to_numpy()
+	price = chunk[priceColumn].to_numpy(dtype=float)
+	lnprice = np.log(price)
+
+	prevDay = np.concatenate([[carry[0]],day[:-1]])
+	prevLnprice = np.concatenate([[carry[1]],lnprice[:-1]])
+	lnreturn = lnprice - prevLnprice
+	lnreturn[day != prevDay] = np.nan
+	absReturn = np.abs(lnreturn)
+	prevAbsReturn = np.concatenate([[carry[2]],absReturn[:-1]])
+
+	df = pd.DataFrame({ \
+		'Open':chunk['Open'].to_numpy(dtype=float) if 'Open' in chunk else price, \
+		'High':chunk['High'].to_numpy(dtype=float) if 'High' in chunk else price, \
+		'Low':chunk['Low'].to_numpy(dtype=float) if 'Low' in chunk else price, \
+		'Close':price, \
+		'RealizedVariance':lnreturn**2, \
+		'BipowerVariation':(np.pi/2)*absReturn*prevAbsReturn, \
+		'Count':1 \
+	},index=pd.DatetimeIndex(day,name='Date'))
+	carry = (day[-1],lnprice[-1],absReturn[-1])
+	return combineIntradayAggregates(df), carry
+
+def combineIntradayAggregates(df):
+	# df is a dataframe of daily (or partial daily) aggregates, rows with the same date are merged
+	df = df.groupby(level=0).agg({ \
+		'Open':'first', \
+		'High':'max', \
+		'Low':'min', \
+		'Close':'last', \
+		'RealizedVariance':'sum', \
+		'BipowerVariation':'sum', \
+		'Count':'sum' \
+	})
+	return df
+
+def calcIntradayDailyAggregates(filename,chunksize=1000000,dateFrom=None):
+	# stream an intraday csv file in chunks of chunksize rows, only the daily aggregates are kept in memory
+	# dateFrom: days before dateFrom are skipped (already in the cache)
+	aggregates = []
+	carry = (np.datetime64('NaT'),np.nan,np.nan)
+	for chunk in pd.read_csv(filename,chunksize=chunksize):
+		if dateFrom is not None:
+			chunk = chunk[pd.to_datetime(chunk['DateTime']) >= dateFrom]
+			if chunk.shape[0] == 0:
+				continue
+		df, carry = calcIntradayChunkAggregates(chunk,carry)
+		aggregates.append(df)
+	if len(aggregates) == 0:
+		return None
+	return combineIntradayAggregates(pd.concat(aggregates))
+
+def getIntradayCachedAggregates(filename,cacheFilename,chunksize=1000000):
+	# the daily aggregates of an intraday file are cached in cacheFilename
+	# if the intraday file changed after the cache was written, only the days from the last cached day are reprocessed
+	# (the last cached day may have been incomplete)
+	cache = None
+	dateFrom = None
+	if os.path.exists(cacheFilename):
+		if os.path.getmtime(cacheFilename) >= os.path.getmtime(filename):
+			return cacheFilename
+		cache = pd.read_csv(cacheFilename,index_col='Date',parse_dates=['Date'])
+		if cache.shape[0] > 0:
+			dateFrom = cache.index[-1]
+			cache = cache.loc[cache.index < dateFrom]
+
+	df = calcIntradayDailyAggregates(filename,chunksize,dateFrom)
+	if cache is not None and df is not None:
+		df = pd.concat([cache,df])
+	elif df is None:
+		df = cache if cache is not None else pd.DataFrame(columns=['Open','High','Low','Close','RealizedVariance','BipowerVariation','Count'])
+	df.index.name = 'Date'
+	df.to_csv(cacheFilename+'.tmp')
+	os.replace(cacheFilename+'.tmp',cacheFilename)
+	return cacheFilename
+
+def calcIntradayDailyPanel(sectors,intradayFolder='IntradayPrices\\',dailyFolder='IntradayDaily\\',chunksize=1000000,maxWorkers=None):
+	# the intraday files of a sector are intradayFolder+sector+'\\*.csv', with columns DateTime and Price (ticks) or Open, High, Low, Close (bars)
+	# every file is aggregated in a separate process, and the daily panel of each sector is written to dailyFolder+sector+'.JK_D.csv'
+	# with the same layout as DailyPrices plus the RealizedVariance, BipowerVariation and Count columns
+	cacheFolder = dailyFolder+'_cache\\'
+	tasks = {}
+	for sector in sectors:
+		Path(cacheFolder+sector).mkdir(parents=True, exist_ok=True)
+		tasks[sector] = []
+		for filename in sorted(Path(intradayFolder+sector).glob('*.csv')):
+			tasks[sector].append((str(filename),cacheFolder+sector+'\\'+filename.name))
+
+	with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+		futures = {}
+		for sector in sectors:
+			futures[sector] = [executor.submit(getIntradayCachedAggregates,filename,cacheFilename,chunksize) for filename, cacheFilename in tasks[sector]]
+		for sector in sectors:
+			cacheFilenames = [future.result() for future in futures[sector]]
+			df = pd.concat([pd.read_csv(cacheFilename,index_col='Date',parse_dates=['Date']) for cacheFilename in cacheFilenames])
+			df = combineIntradayAggregates(df.sort_index())
+			df.to_csv(dailyFolder+sector+'.JK_D.csv',date_format='%d-%m-%Y')
+	return True
+
 # ==============================
 # DATA PREPARATION BASED ON OUTPUTMODE
 def calcLnreturn (sectorsData):
@@ -41,13 +171,20 @@ def calcLnreturn (sectorsData):
 	return lnreturn
 
 # ==============================
-def calcLnvariance (sectorsData):
+def calcLnvariance (sectorsData,estimator='Parkinson'):
 	# sectorsData is a dict consist of dataframes of data for each sector/market
 	# example: sectorsData['AGRI'] = pd.Dataframe(columns=['Open','High','Low','Close'])
 	# np.log is natural log
+	# estimator:
+	# Parkinson: 0.361*(ln High - ln Low)^2
+	# RealizedVariance / BipowerVariation: daily sum from intraday returns, see calcIntradayDailyPanel
+	estimator = 'Parkinson' if estimator is None else estimator
 	lnvariance = pd.DataFrame()
 	for sector in sectorsData:
-		lnvariance[sector] = 0.361*((np.log(sectorsData[sector]['High'])-np.log(sectorsData[sector]['Low']))**2)
+		if estimator == 'Parkinson':
+			lnvariance[sector] = 0.361*((np.log(sectorsData[sector]['High'])-np.log(sectorsData[sector]['Low']))**2)
+		else:
+			lnvariance[sector] = sectorsData[sector][estimator]
 	return lnvariance
 
 def calcVolatilityDiebold(lnvariance,marketDays):
@@ -100,6 +237,92 @@ def calcSetStats(volatility):
 			volatility[sector].count()
 	return setStats
 
+class RollingStats:
+	# The statistics of calcSetStats and the pearson correlation table of a sliding window,
+	# updated when an observation enters (add) or leaves (remove) the window instead of recomputed on every window.
+	# The moments come from the power sums of x-shift (shift is the first observation, it limits the cancellation),
+	# the median, max and min from a sorted copy of the window of each sector.
+	def __init__(self,sectors):
+		self.sectors = sectors
+		self.count = 0
+		self.shift = None
+		self.sums = np.zeros((4,len(sectors)))
+		self.cross = np.zeros((len(sectors),len(sectors)))
+		self.sorted = [[] for sector in sectors]
+
+	def add(self,x):
+		x = np.asarray(x,dtype=float)
+		if self.shift is None:
+			self.shift = x.copy()
+		d = x - self.shift
+		self.sums += d**np.arange(1,5)[:,None]
+		self.cross += np.outer(d,d)
+		for j in range(len(x)):
+			bisect.insort(self.sorted[j],x[j])
+		self.count += 1
+
+	def remove(self,x):
+		x = np.asarray(x,dtype=float)
+		d = x - self.shift
+		self.sums -= d**np.arange(1,5)[:,None]
+		self.cross -= np.outer(d,d)
+		for j in range(len(x)):
+			del self.sorted[j][bisect.bisect_left(self.sorted[j],x[j])]
+		self.count -= 1
+
+	def getSetStats(self):
+		# same columns and estimators as calcSetStats (sample std, adjusted skew and excess kurtosis of pandas)
+		n = self.count
+		s1, s2, s3, s4 = self.sums / n
+		m2 = s2 - s1**2
+		m3 = s3 - 3*s1*s2 + 2*s1**3
+		m4 = s4 - 4*s1*s3 + 6*s1**2*s2 - 3*s1**4
+		half = n // 2
+		setStats = pd.DataFrame(index=pd.Index(self.sectors,name='sector'))
+		setStats['mean'] = self.shift + s1
+		setStats['median'] = [(values[half]+values[-half-1])/2 for values in self.sorted]
+		setStats['max'] = [values[-1] for values in self.sorted]
+		setStats['min'] = [values[0] for values in self.sorted]
+		setStats['stdDev'] = np.sqrt(m2*n/(n-1))
+		setStats['skew'] = np.sqrt(n*(n-1))/(n-2) * m3/m2**1.5
+		setStats['kurtosis'] = (n-1)/((n-2)*(n-3)) * ((n+1)*m4/m2**2 - 3*(n-1))
+		setStats['count'] = n
+		return setStats
+
+	def getCorrelationTable(self):
+		# same as volatility.corr(method='pearson') of the window
+		n = self.count
+		cov = (self.cross - np.outer(self.sums[0],self.sums[0])/n) / (n-1)
+		sd = np.sqrt(np.diag(cov))
+		return pd.DataFrame(cov/np.outer(sd,sd),index=self.sectors,columns=self.sectors)
+
+def calcRollingStats(volatility, rollingWindow=200):
+	# the rollingSpillovers['stats'] and ['correlation'] of calcRollingSpillovers, for the backends without the window loop
+	sectors = volatility.columns
+	values = volatility.to_numpy(dtype=float)
+	dates = volatility.index[rollingWindow-1:]
+	stats = RollingStats(sectors)
+	for x in values[:rollingWindow-1]:
+		stats.add(x)
+	setStats = []
+	correlation = []
+	for i in range(len(dates)):
+		stats.add(values[i+rollingWindow-1])
+		setStats.append(stats.getSetStats().to_numpy())
+		correlation.append(stats.getCorrelationTable().to_numpy())
+		stats.remove(values[i])
+	setStats = np.array(setStats)
+	correlation = np.array(correlation)
+
+	rollingStats = {}
+	rollingStats['stats'] = {}
+	for j, stat in enumerate(['mean','median','max','min','stdDev','skew','kurtosis','count']):
+		rollingStats['stats'][stat] = pd.DataFrame(setStats[:,:,j],index=dates,columns=sectors)
+	rollingStats['correlation'] = {}
+	for j, sector in enumerate(sectors):
+		rollingStats['correlation'][sector] = pd.DataFrame(correlation[:,:,j],index=dates,columns=sectors)
+	return rollingStats
+
 # ==============================
 # Spillovers Table Based on Diebold Yilmaz 2012
 # ==============================
@@ -146,16 +369,33 @@ def calcAvgSpilloversTable(volatility, forecast_horizon=10, lag_order=None):
 # ==============================
 # Rolling Spillovers Based on Diebold Yilmaz 2012
 # ==============================
-def calcRollingSpillovers(volatility, forecast_horizon=10, lag_order=None,rollingWindow=200):
+def calcRollingSpillovers(volatility, forecast_horizon=10, lag_order=None,rollingWindow=200,stateFolder=None,checkpointKey='rolling',checkpointEvery=50,backend='statsmodels',withStats=False):
 	# rollingSpillovers: 
 	# [total] : spillover_index
 	# [to][sector] : Cont_To[sector]
 	# [from][sector] : Cont_From[sector]
 	# [net][sector] : Cont_Net[sector]
 	# [pairwise][sector_to][sector_from] : spilloversTable.loc['sector_From','sector_To']
+	# withStats:
+	# [stats][stat][sector] : calcSetStats of the window (see RollingStats)
+	# [correlation][sector_a][sector_b] : pearson correlation of the window
+
+	# stateFolder: the finished windows are saved every checkpointEvery windows to stateFolder+checkpointKey+'.pkl',
+	# a rerun with the same volatility and parameters continues from the first unfinished window
+
+	# backend: see SPILLOVERS BACKENDS, 'statsmodels' is this window loop,
+	# the other backends run all the windows at once (no checkpoint)
 
 	forecast_horizon = 10 if forecast_horizon is None else forecast_horizon
 	rollingWindow = 200 if rollingWindow is None else rollingWindow
+	checkpointEvery = 50 if checkpointEvery is None else checkpointEvery
+
+	if backend is not None and backend != 'statsmodels':
+		fevd, dates, lag_order = calcRollingFevd(volatility,forecast_horizon,lag_order,rollingWindow,backend)
+		rollingSpillovers = genRollingSpillovers(fevd,dates,volatility.columns)
+		if withStats:
+			rollingSpillovers.update(calcRollingStats(volatility,rollingWindow))
+		return rollingSpillovers
 	
 	rollingSpillovers = {}
 	rollingSpillovers['total'] = pd.DataFrame()
@@ -168,8 +408,31 @@ def calcRollingSpillovers(volatility, forecast_horizon=10, lag_order=None,rollin
 	for sector in sectors:
 		rollingSpillovers['pairwiseTo'][sector] = pd.DataFrame(columns=sectors)
 		rollingSpillovers['pairwiseNet'][sector] = pd.DataFrame(columns=sectors)
+	if withStats:
+		rollingSpillovers['stats'] = {}
+		for stat in ['mean','median','max','min','stdDev','skew','kurtosis','count']:
+			rollingSpillovers['stats'][stat] = pd.DataFrame(columns=sectors)
+		rollingSpillovers['correlation'] = {}
+		for sector in sectors:
+			rollingSpillovers['correlation'][sector] = pd.DataFrame(columns=sectors)
+
+	start = 0
+	nWindows = volatility.shape[0]-(rollingWindow-1)
+	if stateFolder is not None:
+		fingerprint = calcFingerprint(volatility,forecast_horizon,lag_order,rollingWindow)
+		state = loadCheckpoint(stateFolder,checkpointKey,fingerprint)
+		# a checkpoint without the window statistics is computed again when they are needed
+		if state is not None and (not withStats or 'stats' in state['rollingSpillovers']):
+			rollingSpillovers, lag_order, start = state['rollingSpillovers'], state['lag_order'], state['start']
+
+	# the statistics follow the same windows: the new observation is added, the oldest removed
+	if withStats:
+		values = volatility.to_numpy(dtype=float)
+		stats = RollingStats(sectors)
+		for x in values[start:start+rollingWindow-1]:
+			stats.add(x)
 	
-	for i in range(volatility.shape[0]-(rollingWindow-1)):
+	for i in range(start,nWindows):
 		UBound = i+rollingWindow
 		df = volatility.iloc[i:UBound]
 		spilloversTable, lag_order, forecast_horizon = calcAvgSpilloversTable(df,forecast_horizon,lag_order)
@@ -182,8 +445,395 @@ def calcRollingSpillovers(volatility, forecast_horizon=10, lag_order=None,rollin
 			rollingSpillovers['pairwiseTo'][sector].loc[volatility.iloc[UBound-1].name] = spilloversTable[sector]
 			rollingSpillovers['pairwiseNet'][sector].loc[volatility.iloc[UBound-1].name] = spilloversTable[sector]-spilloversTable.loc[sector]
 
+		if withStats:
+			stats.add(values[UBound-1])
+			setStats = stats.getSetStats()
+			for stat in rollingSpillovers['stats']:
+				rollingSpillovers['stats'][stat].loc[volatility.iloc[UBound-1].name] = setStats[stat]
+			correlationTable = stats.getCorrelationTable()
+			for sector in sectors:
+				rollingSpillovers['correlation'][sector].loc[volatility.iloc[UBound-1].name] = correlationTable[sector]
+			stats.remove(values[i])
+
+		if stateFolder is not None and ((i+1)%checkpointEvery == 0 or i+1 == nWindows):
+			saveCheckpoint(stateFolder,checkpointKey,fingerprint,{'rollingSpillovers':rollingSpillovers,'lag_order':lag_order,'start':i+1})
+
+	# the same structure as genRollingSpillovers: the spillovers table rows carry the Cont_* totals,
+	# only the sectors are kept, with the float values and the dates index of volatility
+	for key in ['total','to','from','net']:
+		rollingSpillovers[key] = rollingSpillovers[key].astype(float).rename_axis(volatility.index.name)
+	for key in ['to','from','net']:
+		rollingSpillovers[key] = rollingSpillovers[key][sectors]
+	for key in ['pairwiseTo','pairwiseNet']:
+		for sector in sectors:
+			rollingSpillovers[key][sector] = rollingSpillovers[key][sector].astype(float).rename_axis(volatility.index.name)
+	return rollingSpillovers
+
+def calcGeneralizedFevd(coefs,sigma_u,forecast_horizon=10):
+	# coefs is an array (lag_order, n, n) of the VAR coefficient matrices, sigma_u is the (n, n) residuals covariance
+	# the same generalized FEVD as results.fevd(forecast_horizon, sigma_u/sd_u) in calcAvgSpilloversTable,
+	# fevd[i,j] is the % of the forecast error variance of i from the shocks of j, each row sums to 100
+	# coefs (..., lag_order, n, n) and sigma_u (..., n, n) with leading dimensions give a batch of fevd (..., n, n)
+	lag_order = coefs.shape[-3]
+	n = sigma_u.shape[-1]
+	ma = np.zeros(sigma_u.shape[:-2]+(forecast_horizon,n,n))
+	ma[...,0,:,:] = np.eye(n)
+	for h in range(1,forecast_horizon):
+		for i in range(min(h,lag_order)):
+			ma[...,h,:,:] += coefs[...,i,:,:] @ ma[...,h-1-i,:,:]
+	fe = ((ma @ sigma_u[...,None,:,:])**2).sum(-3) / np.diagonal(sigma_u,axis1=-2,axis2=-1)[...,None,:]
+	fevd = fe / fe.sum(-1)[...,None] * 100
+	return fevd
+
+def genRollingSpillovers(fevd,dates,sectors):
+	# fevd is an array (T, n, n), fevd[t] is the generalized FEVD table at dates[t] (see calcGeneralizedFevd)
+	# return the same structure as calcRollingSpillovers
+	n = len(sectors)
+	diag = fevd[:,range(n),range(n)]
+	cont_to = fevd.sum(1) - diag
+	cont_from = fevd.sum(2) - diag
+
+	rollingSpillovers = {}
+	rollingSpillovers['total'] = pd.DataFrame(cont_to.sum(1)/n,index=dates)
+	rollingSpillovers['to'] = pd.DataFrame(cont_to,index=dates,columns=sectors)
+	rollingSpillovers['from'] = pd.DataFrame(cont_from,index=dates,columns=sectors)
+	rollingSpillovers['net'] = pd.DataFrame(cont_to-cont_from,index=dates,columns=sectors)
+	rollingSpillovers['pairwiseTo'] = {}
+	rollingSpillovers['pairwiseNet'] = {}
+	for j, sector in enumerate(sectors):
+		rollingSpillovers['pairwiseTo'][sector] = pd.DataFrame(fevd[:,:,j],index=dates,columns=sectors)
+		rollingSpillovers['pairwiseNet'][sector] = pd.DataFrame(fevd[:,:,j]-fevd[:,j,:],index=dates,columns=sectors)
 	return rollingSpillovers
 
+# ==============================
+# Network Analytics of the Rolling Spillovers
+# ==============================
+def calcRollingSpilloversTensor(rollingSpillovers):
+	# return fevd (T, n, n), dates, sectors from the rolling Spillovers structure
+	# fevd[t,i,j] = rollingSpillovers['pairwiseTo'][sector_j][sector_i] at dates[t], the same layout as calcGeneralizedFevd
+	sectors = list(rollingSpillovers['pairwiseTo'].keys())
+	dates = rollingSpillovers['pairwiseTo'][sectors[0]].index
+	fevd = np.stack([rollingSpillovers['pairwiseTo'][sector][sectors].to_numpy(dtype=float) for sector in sectors],axis=2)
+	return fevd, dates, sectors
+
+def calcNetworkAnalytics(fevd, dates, sectors, threshold=None, iterations=100):
+	# fevd (T, n, n) is the spillovers network of every date, the edge j -> i has the weight fevd[t,i,j]
+	# every measure is computed for all dates at once
+	# networkAnalytics:
+	# [inStrength][sector] : spillovers received from the others
+	# [outStrength][sector] : spillovers transmitted to the others
+	# [net][sector] : outStrength - inStrength
+	# [netRank][sector] : 1 is the largest net transmitter of the date
+	# [centrality][sector] : eigenvector centrality of the transmitters, sums to 1 on each date
+	# [density] : share of the pairwise spillovers above threshold (default 100/n, an even split of the forecast error variance)
+	T, n = fevd.shape[0], fevd.shape[1]
+	threshold = 100/n if threshold is None else threshold
+
+	weight = fevd.copy()
+	weight[:,range(n),range(n)] = 0
+	inStrength = weight.sum(2)
+	outStrength = weight.sum(1)
+	net = outStrength - inStrength
+	netRank = (-net).argsort(1).argsort(1) + 1
+
+	# batched power iteration of (I + W'), the transmitter j is central if it transmits to central sectors
+	centrality = np.full((T,n),1/n)
+	for i in range(iterations):
+		centrality = centrality + np.einsum('tij,ti->tj',weight,centrality)
+		centrality = centrality / centrality.sum(1)[:,None]
+
+	density = (weight > threshold).sum((1,2)) / (n*(n-1))
+
+	networkAnalytics = {}
+	networkAnalytics['inStrength'] = pd.DataFrame(inStrength,index=dates,columns=sectors)
+	networkAnalytics['outStrength'] = pd.DataFrame(outStrength,index=dates,columns=sectors)
+	networkAnalytics['net'] = pd.DataFrame(net,index=dates,columns=sectors)
+	networkAnalytics['netRank'] = pd.DataFrame(netRank,index=dates,columns=sectors)
+	networkAnalytics['centrality'] = pd.DataFrame(centrality,index=dates,columns=sectors)
+	networkAnalytics['density'] = pd.DataFrame(density,index=dates,columns=['density'])
+	return networkAnalytics
+
+# ==============================
+# TVP-VAR Spillovers Based on Antonakakis, Chatziantoniou, Gabauer 2020
+# ==============================
+def calcTVPVARSpillovers(volatility, forecast_horizon=10, lag_order=None, kappa1=0.99, kappa2=0.96):
+	# Time-varying parameter VAR estimated by a Kalman filter with forgetting factors (Koop and Korobilis 2014):
+	# kappa1 discounts the coefficients covariance, kappa2 is the EWMA decay of the residuals covariance.
+	# One pass over volatility, the spillovers are available at every date after the first lag_order observations.
+	# The prior is the OLS VAR of the whole sample.
+	# return the same structure as calcRollingSpillovers
+	forecast_horizon = 10 if forecast_horizon is None else forecast_horizon
+	kappa1 = 0.99 if kappa1 is None else kappa1
+	kappa2 = 0.96 if kappa2 is None else kappa2
+
+	model = VAR(volatility)
+	if lag_order==None:
+		results = model.fit(lag_order,ic='aic')
+		lag_order = results.k_ar
+	else:
+		results = model.fit(lag_order)
+
+	y = volatility.to_numpy(dtype=float)
+	T, n = y.shape
+	k = 1 + n*lag_order
+
+	# state: vec(B), B is (k, n) with y_t = B' x_t and x_t = [1, y_t-1, ..., y_t-lag_order]
+	B = np.asarray(results.params)
+	sigma_u = np.asarray(results.sigma_u)
+	P = np.kron(sigma_u,np.linalg.inv(results.endog_lagged.T @ results.endog_lagged))
+
+	fevd = np.empty((T-lag_order,n,n))
+	for t in range(lag_order,T):
+		x = np.concatenate([[1.0],y[t-lag_order:t][::-1].ravel()])
+		X = np.kron(np.eye(n),x[None,:])
+
+		# predict
+		P = P / kappa1
+		e = y[t] - x @ B
+		sigma_u = kappa2*sigma_u + (1-kappa2)*np.outer(e,e)
+
+		# update
+		PX = P @ X.T
+		K = np.linalg.solve(X @ PX + sigma_u,PX.T).T
+		B = B + (K @ e).reshape(n,k).T
+		P = P - K @ PX.T
+		P = (P + P.T)/2
+
+		coefs = B[1:].reshape(lag_order,n,n).transpose(0,2,1)
+		fevd[t-lag_order] = calcGeneralizedFevd(coefs,sigma_u,forecast_horizon)
+
+	rollingSpillovers = genRollingSpillovers(fevd,volatility.index[lag_order:],volatility.columns)
+	return rollingSpillovers
+
+# ==============================
+# Rolling Spillovers With Variant Rolling Window
+# ==============================
+def calcRollingWindowSweep(volatility, rollingWindows, forecast_horizon=10, lag_order=None):
+	# volatility has max(rollingWindows)-1 observations before the first rolling date (see getWithRollingWindow)
+	# return sweepSpillovers[rollingWindow]: the calcRollingSpillovers structure of each rollingWindow, on the same dates
+	sweepFevd, dates, lag_order = calcRollingWindowFevd(volatility,rollingWindows,forecast_horizon,lag_order)
+	sweepSpillovers = {}
+	for rollingWindow in sweepFevd:
+		sweepSpillovers[rollingWindow] = genRollingSpillovers(sweepFevd[rollingWindow],dates,volatility.columns)
+	return sweepSpillovers
+
+def calcRollingWindowFevd(volatility, rollingWindows, forecast_horizon=10, lag_order=None):
+	# return sweepFevd[rollingWindow] (T, n, n) the generalized FEVD of every rolling date (see calcGeneralizedFevd), dates, lag_order
+	#
+	# The VAR of every (end date, rollingWindow) is solved from the Gram matrices X'X, X'Y, Y'Y of its window.
+	# They are the difference of two prefix sums of the lagged design, computed once for all rolling windows.
+	forecast_horizon = 10 if forecast_horizon is None else forecast_horizon
+	rollingWindows = sorted(rollingWindows)
+	maxWindow = rollingWindows[-1]
+	if lag_order==None:
+		lag_order = VAR(volatility.iloc[:maxWindow]).fit(lag_order,ic='aic').k_ar
+
+	# centering does not change the VAR with intercept, it keeps the prefix sums small
+	y = volatility.to_numpy(dtype=float)
+	y = y - y.mean(0)
+	T, n = y.shape
+	k = 1 + n*lag_order
+	# the VAR of a window needs more observations (rollingWindow-lag_order) than coefficients per equation (k)
+	if rollingWindows[0]-lag_order <= k:
+		raise ValueError('rollingWindow '+str(rollingWindows[0])+' has '+str(rollingWindows[0]-lag_order)+' observations for '+str(k)+' VAR coefficients per equation (lag_order '+str(lag_order)+')')
+
+	# regression rows: Y[r] = y[r+lag_order], X[r] = [1, y[r+lag_order-1], ..., y[r]]
+	Y = y[lag_order:]
+	X = np.hstack([np.ones((T-lag_order,1))] + [y[lag_order-1-i:T-1-i] for i in range(lag_order)])
+	sumXX = np.concatenate([np.zeros((1,k,k)),np.cumsum(X[:,:,None]*X[:,None,:],axis=0)])
+	sumXY = np.concatenate([np.zeros((1,k,n)),np.cumsum(X[:,:,None]*Y[:,None,:],axis=0)])
+	sumYY = np.concatenate([np.zeros((1,n,n)),np.cumsum(Y[:,:,None]*Y[:,None,:],axis=0)])
+
+	# the rolling window ending at observation e has the regression rows e-rollingWindow+1 ... e-lag_order
+	end = np.arange(maxWindow-1,T)
+	dates = volatility.index[end]
+	sweepFevd = {}
+	for rollingWindow in rollingWindows:
+		lower = end-rollingWindow+1
+		upper = end-lag_order+1
+		XX = sumXX[upper] - sumXX[lower]
+		XY = sumXY[upper] - sumXY[lower]
+		YY = sumYY[upper] - sumYY[lower]
+
+		B = np.linalg.solve(XX,XY)
+		sigma_u = (YY - XY.transpose(0,2,1) @ B) / (rollingWindow-lag_order-k)
+		sigma_u = (sigma_u + sigma_u.transpose(0,2,1))/2
+		coefs = B[:,1:].reshape(len(end),lag_order,n,n).transpose(0,1,3,2)
+
+		sweepFevd[rollingWindow] = calcGeneralizedFevd(coefs,sigma_u,forecast_horizon)
+	return sweepFevd, dates, lag_order
+
+# ==============================
+# SPILLOVERS BACKENDS:
+# fit the VAR of every rolling window -> generalized FEVD
+# ==============================
+# A backend is a function (volatility, forecast_horizon, lag_order, rollingWindow) -> fevd (T, n, n), lag_order
+# with fevd[t] the generalized FEVD of the window ending at the rolling date t (see calcGeneralizedFevd).
+# 'statsmodels' is the reference: calcAvgSpilloversTable on every window.
+# 'fast' solves the windows from their Gram matrices: with numba a compiled kernel that slides the window,
+# without numba the numpy prefix sums of calcRollingWindowFevd.
+def calcRollingFevdStatsmodels(volatility, forecast_horizon=10, lag_order=None, rollingWindow=200):
+	n = volatility.shape[1]
+	fevd = np.empty((volatility.shape[0]-(rollingWindow-1),n,n))
+	for i in range(fevd.shape[0]):
+		spilloversTable, lag_order, forecast_horizon = calcAvgSpilloversTable(volatility.iloc[i:i+rollingWindow],forecast_horizon,lag_order)
+		fevd[i] = spilloversTable.iloc[:n,:n].to_numpy(dtype=float)
+	return fevd, lag_order
+
+def calcRollingFevdKernel(y, lag_order, rollingWindow, forecast_horizon, fevd):
+	# y (T, n) contiguous float64, centered. fevd (T-rollingWindow+1, n, n) is filled in place.
+	# The Gram matrices X'X, X'Y, Y'Y of the window are updated by one regression row in and one out,
+	# then the VAR is solved by Cholesky, no allocation inside the loop over windows.
+	# Plain python and numpy indexing, compiled by numba when available (calcRollingFevdKernelJit).
+	T, n = y.shape
+	k = 1 + n*lag_order
+	XX = np.zeros((k,k))
+	XY = np.zeros((k,n))
+	YY = np.zeros((n,n))
+	x = np.empty(k)
+	L = np.empty((k,k))
+	B = np.empty((k,n))
+	sigma_u = np.empty((n,n))
+	ma = np.empty((forecast_horizon,n,n))
+	fe = np.empty((n,n))
+
+	# the regression row r is Y[r] = y[r+lag_order], X[r] = [1, y[r+lag_order-1], ..., y[r]]
+	# the window ending at observation e has the rows e-rollingWindow+1 ... e-lag_order
+	for w in range(T-rollingWindow+1):
+		# the first window adds all its rows, the next ones remove the row w-1 and add the row rollingWindow-lag_order+w-1
+		for update in range(2 if w > 0 else rollingWindow-lag_order):
+			if w == 0:
+				r, sign = update, 1.0
+			elif update == 0:
+				r, sign = w-1, -1.0
+			else:
+				r, sign = rollingWindow-lag_order+w-1, 1.0
+			x[0] = 1.0
+			for l in range(lag_order):
+				for b in range(n):
+					x[1+l*n+b] = y[r+lag_order-1-l,b]
+			for a in range(k):
+				for b in range(k):
+					XX[a,b] += sign*x[a]*x[b]
+				for b in range(n):
+					XY[a,b] += sign*x[a]*y[r+lag_order,b]
+			for a in range(n):
+				for b in range(n):
+					YY[a,b] += sign*y[r+lag_order,a]*y[r+lag_order,b]
+
+		# Cholesky XX = L L'
+		for a in range(k):
+			for b in range(a+1):
+				v = XX[a,b]
+				for m in range(b):
+					v -= L[a,m]*L[b,m]
+				if a == b:
+					L[a,a] = np.sqrt(v)
+				else:
+					L[a,b] = v / L[b,b]
+		# B = XX^-1 XY: forward then backward substitution
+		for c in range(n):
+			for a in range(k):
+				v = XY[a,c]
+				for m in range(a):
+					v -= L[a,m]*B[m,c]
+				B[a,c] = v / L[a,a]
+			for a in range(k-1,-1,-1):
+				v = B[a,c]
+				for m in range(a+1,k):
+					v -= L[m,a]*B[m,c]
+				B[a,c] = v / L[a,a]
+		# sigma_u = (Y'Y - XY' B) / (observations - k)
+		for a in range(n):
+			for b in range(n):
+				v = YY[a,b]
+				for m in range(k):
+					v -= XY[m,a]*B[m,b]
+				sigma_u[a,b] = v / (rollingWindow-lag_order-k)
+		for a in range(n):
+			for b in range(a):
+				v = (sigma_u[a,b]+sigma_u[b,a])/2
+				sigma_u[a,b] = v
+				sigma_u[b,a] = v
+
+		# moving average coefficients, coefs[l][a,b] = B[1+l*n+b, a]
+		for a in range(n):
+			for b in range(n):
+				ma[0,a,b] = 1.0 if a == b else 0.0
+		for h in range(1,forecast_horizon):
+			for a in range(n):
+				for b in range(n):
+					v = 0.0
+					for l in range(min(h,lag_order)):
+						for m in range(n):
+							v += B[1+l*n+m,a]*ma[h-1-l,m,b]
+					ma[h,a,b] = v
+		# generalized FEVD
+		for a in range(n):
+			for b in range(n):
+				fe[a,b] = 0.0
+		for h in range(forecast_horizon):
+			for a in range(n):
+				for b in range(n):
+					v = 0.0
+					for m in range(n):
+						v += ma[h,a,m]*sigma_u[m,b]
+					fe[a,b] += v*v
+		for a in range(n):
+			total = 0.0
+			for b in range(n):
+				fe[a,b] = fe[a,b] / sigma_u[b,b]
+				total += fe[a,b]
+			for b in range(n):
+				fevd[w,a,b] = fe[a,b] / total * 100
+	return fevd
+
+calcRollingFevdKernelJit = njit(cache=True)(calcRollingFevdKernel) if njit is not None else None
+
+def calcRollingFevdFast(volatility, forecast_horizon=10, lag_order=None, rollingWindow=200):
+	forecast_horizon = 10 if forecast_horizon is None else forecast_horizon
+	if calcRollingFevdKernelJit is None:
+		sweepFevd, dates, lag_order = calcRollingWindowFevd(volatility,[rollingWindow],forecast_horizon,lag_order)
+		return sweepFevd[rollingWindow], lag_order
+	if lag_order==None:
+		lag_order = VAR(volatility.iloc[:rollingWindow]).fit(lag_order,ic='aic').k_ar
+	# centering does not change the VAR with intercept, it keeps the sums of the sliding window small
+	y = volatility.to_numpy(dtype=float)
+	y = np.ascontiguousarray(y - y.mean(0))
+	n = y.shape[1]
+	fevd = np.empty((y.shape[0]-(rollingWindow-1),n,n))
+	calcRollingFevdKernelJit(y,int(lag_order),int(rollingWindow),int(forecast_horizon),fevd)
+	return fevd, lag_order
+
+spilloversBackends = {
+	'statsmodels': calcRollingFevdStatsmodels,
+	'fast': calcRollingFevdFast,
+}
+
+def calcRollingFevd(volatility, forecast_horizon=10, lag_order=None, rollingWindow=200, backend='statsmodels'):
+	# return fevd (T, n, n), dates, lag_order of the rolling windows computed by spilloversBackends[backend]
+	forecast_horizon = 10 if forecast_horizon is None else forecast_horizon
+	rollingWindow = 200 if rollingWindow is None else rollingWindow
+	fevd, lag_order = spilloversBackends[backend](volatility,forecast_horizon,lag_order,rollingWindow)
+	dates = volatility.index[rollingWindow-1:]
+	return fevd, dates, lag_order
+
+def checkSpilloversBackends(volatility, forecast_horizon=10, lag_order=None, rollingWindow=200, backend='fast', reference='statsmodels', windows=20, tolerance=1e-6):
+	# compare backend with reference on the first windows rolling windows,
+	# return the largest difference of the FEVD (in %), ValueError when it is above tolerance
+	# with numba the 'fast' backend runs the compiled kernel, it is also compared with the numpy path of the backend
+	rollingWindow = 200 if rollingWindow is None else rollingWindow
+	sample = volatility.iloc[:rollingWindow-1+windows]
+	fevd, dates, lag_order = calcRollingFevd(sample,forecast_horizon,lag_order,rollingWindow,backend)
+	referenceFevd, dates, referenceLag_order = calcRollingFevd(sample,forecast_horizon,lag_order,rollingWindow,reference)
+	difference = np.abs(fevd-referenceFevd).max()
+	if backend == 'fast' and calcRollingFevdKernelJit is not None:
+		sweepFevd, dates, lag_order = calcRollingWindowFevd(sample,[rollingWindow],forecast_horizon,lag_order)
+		difference = max(difference,np.abs(fevd-sweepFevd[rollingWindow]).max())
+	if difference > tolerance:
+		raise ValueError('spilloversBackend '+backend+' differs from '+reference+' by '+str(difference)+' on '+str(len(dates))+' windows')
+	return difference
+
 # ==============================
 # SENSITIVITY ANALYSIS:
 # Average and Dynamic Spillovers With Variant Lag Order
@@ -221,15 +871,395 @@ def calcRollingSensitivityAnalysis(newRollingSpillovers):
 	
 	return sensitivityRange
 
+# ==============================
+# CHECKPOINT
+# ==============================
+def calcFingerprint(*params):
+	# params are the data and parameters of a unit of work, a checkpoint is only reused with the same fingerprint
+	fingerprint = hashlib.sha256()
+	for param in params:
+		if isinstance(param,(pd.DataFrame,pd.Series)):
+			fingerprint.update(pd.util.hash_pandas_object(param).to_numpy().tobytes())
+			fingerprint.update(str(list(param.columns) if isinstance(param,pd.DataFrame) else param.name).encode())
+		else:
+			fingerprint.update(str(param).encode())
+		fingerprint.update(b'|')
+	return fingerprint.hexdigest()
+
+def saveCheckpoint(stateFolder,key,fingerprint,state):
+	# atomic write: a crash while writing leaves the previous checkpoint untouched
+	# the temporary file is per process: two workers may finish the same requeued unit at the same time
+	filename = stateFolder+key+'.pkl'
+	tmpFilename = filename+'.'+str(os.getpid())+'.tmp'
+	with open(tmpFilename,'wb') as out:
+		pickle.dump({'fingerprint':fingerprint,'state':state},out,protocol=pickle.HIGHEST_PROTOCOL)
+		out.flush()
+		os.fsync(out.fileno())
+	os.replace(tmpFilename,filename)
+	return True
+
+def loadCheckpoint(stateFolder,key,fingerprint):
+	# return None if there is no checkpoint, or if it was saved with other data/parameters
+	filename = stateFolder+key+'.pkl'
+	if not os.path.exists(filename):
+		return None
+	with open(filename,'rb') as inp:
+		checkpoint = pickle.load(inp)
+	if checkpoint['fingerprint'] != fingerprint:
+		return None
+	return checkpoint['state']
+
+# ==============================
+# DISTRIBUTED SWEEP
+# ==============================
+# Work queue on a shared folder (queueFolder), every worker/machine that sees the folder can take part:
+# sweep.pkl : volatility and parameters of the sweep, written once by the coordinator
+# todo      : units waiting for a worker
+# leased    : units taken by a worker, the file modification time is the heartbeat of the lease
+# results   : rolling Spillovers of the finished units (a unit is never computed twice)
+# failed    : units that failed maxAttempts times
+# A unit is a variant (lag_order, forecast_horizon, rollingWindow) on a chunk of the rolling dates,
+# its unitId ends with the fingerprint of the sweep: the files of a sweep on other data are never mixed in.
+# Files are moved between the folders with os.replace, which is atomic on the same filesystem:
+# only one worker can take a unit out of todo.
+# The paths are built with os.path.join, the workers of a shared queue can run on Windows or POSIX machines.
+def getSweepFolder(queueFolder,folder=''):
+	# queueFolder/folder/ with the separator of this machine, to be used as the stateFolder of saveCheckpoint
+	return os.path.join(queueFolder,folder,'')
+
+def getSweepUnitId(lag_order,forecast_horizon,rollingWindow,start,fingerprint):
+	return 'p'+str(lag_order)+'_h'+str(forecast_horizon)+'_w'+str(rollingWindow)+'_d'+str(start)+'_'+fingerprint[:12]
+
+def writeSweepUnit(filename,unit):
+	tmpFilename = filename+'.'+str(os.getpid())+'.tmp'
+	with open(tmpFilename,'w') as out:
+		json.dump(unit,out)
+	os.replace(tmpFilename,filename)
+	return True
+
+def publishSweepUnits(queueFolder,volatility,variants,chunkSize=50,backend='statsmodels'):
+	# volatility has max(rollingWindow)-1 observations before the first rolling date (see getWithRollingWindow)
+	# variants is a list of (lag_order, forecast_horizon, rollingWindow), backend is the spillovers backend of the workers
+	# return every unit of the sweep, the units with a result are not published again
+	for folder in ['todo','leased','results','failed']:
+		Path(getSweepFolder(queueFolder,folder)).mkdir(parents=True, exist_ok=True)
+	maxWindow = max([variant[2] for variant in variants])
+	nDates = volatility.shape[0]-(maxWindow-1)
+	# the chunks (chunkSize) and the backend are part of the sweep: a result of other chunks is never merged
+	fingerprint = calcFingerprint(volatility,maxWindow,chunkSize,backend)
+	saveCheckpoint(getSweepFolder(queueFolder),'sweep',fingerprint,{'volatility':volatility,'maxWindow':maxWindow})
+
+	# the units of a previous sweep on other data or parameters are dropped (their results are kept)
+	for folder in ['todo','leased','failed']:
+		for filename in os.listdir(getSweepFolder(queueFolder,folder)):
+			if not filename.endswith('_'+fingerprint[:12]+'.json'):
+				os.remove(os.path.join(queueFolder,folder,filename))
+
+	units = []
+	for lag_order, forecast_horizon, rollingWindow in variants:
+		for start in range(0,nDates,chunkSize):
+			unit = { \
+				'unitId':getSweepUnitId(lag_order,forecast_horizon,rollingWindow,start,fingerprint), \
+				'fingerprint':fingerprint, \
+				'lag_order':int(lag_order), \
+				'forecast_horizon':int(forecast_horizon), \
+				'rollingWindow':int(rollingWindow), \
+				'start':start, \
+				'end':min(start+chunkSize,nDates), \
+				'backend':backend, \
+				'attempts':0 \
+			}
+			units.append(unit)
+			if os.path.exists(os.path.join(queueFolder,'results',unit['unitId']+'.pkl')):
+				continue
+			if os.path.exists(os.path.join(queueFolder,'leased',unit['unitId']+'.json')):
+				continue
+			if os.path.exists(os.path.join(queueFolder,'failed',unit['unitId']+'.json')):
+				os.remove(os.path.join(queueFolder,'failed',unit['unitId']+'.json'))
+			writeSweepUnit(os.path.join(queueFolder,'todo',unit['unitId']+'.json'),unit)
+	return units
+
+def claimSweepUnit(queueFolder):
+	# move a unit from todo to leased, return None if todo is empty
+	for filename in sorted(os.listdir(getSweepFolder(queueFolder,'todo'))):
+		if not filename.endswith('.json'):
+			continue
+		leaseFile = os.path.join(queueFolder,'leased',filename)
+		try:
+			os.replace(os.path.join(queueFolder,'todo',filename),leaseFile)
+			os.utime(leaseFile)
+			with open(leaseFile) as inp:
+				return json.load(inp)
+		except (FileNotFoundError, PermissionError):
+			# taken by another worker, or dropped by a new sweep
+			continue
+	return None
+
+def releaseSweepUnit(queueFolder,unit,maxAttempts=3):
+	# a failed or expired unit goes back to todo, or to failed after maxAttempts
+	# the lease is first moved to a name of this process (atomic): only one process releases it,
+	# and the unit is never in todo while its old lease still exists
+	releaseFile = os.path.join(queueFolder,'leased',unit['unitId']+'.'+str(os.getpid())+'.release')
+	try:
+		os.replace(os.path.join(queueFolder,'leased',unit['unitId']+'.json'),releaseFile)
+	except FileNotFoundError:
+		# released by another process, or dropped by a new sweep
+		return False
+	unit['attempts'] = unit['attempts']+1
+	folder = 'failed' if unit['attempts'] >= maxAttempts else 'todo'
+	writeSweepUnit(releaseFile,unit)
+	os.replace(releaseFile,os.path.join(queueFolder,folder,unit['unitId']+'.json'))
+	return True
+
+def requeueExpiredSweepUnits(queueFolder,leaseSeconds=600,maxAttempts=3):
+	# the lease of a unit expires when its worker stopped the heartbeat (crashed machine, killed process)
+	for filename in os.listdir(getSweepFolder(queueFolder,'leased')):
+		if not filename.endswith('.json'):
+			continue
+		try:
+			if time.time() - os.path.getmtime(os.path.join(queueFolder,'leased',filename)) < leaseSeconds:
+				continue
+			with open(os.path.join(queueFolder,'leased',filename)) as inp:
+				unit = json.load(inp)
+		except (FileNotFoundError, ValueError):
+			# finished or released meanwhile
+			continue
+		releaseSweepUnit(queueFolder,unit,maxAttempts)
+	return True
+
+def calcSweepUnit(queueFolder,unit):
+	sweep = loadCheckpoint(getSweepFolder(queueFolder),'sweep',unit['fingerprint'])
+	if sweep is None:
+		raise ValueError('sweep.pkl of '+queueFolder+' does not match the unit '+unit['unitId'])
+	# rolling dates start .. end-1 of the variant need rollingWindow-1 observations before them
+	offset = sweep['maxWindow'] - unit['rollingWindow']
+	volatility = sweep['volatility'].iloc[offset+unit['start']:offset+unit['end']+unit['rollingWindow']-1]
+	rollingSpillovers = calcRollingSpillovers(volatility,unit['forecast_horizon'],unit['lag_order'],unit['rollingWindow'],backend=unit['backend'])
+	return rollingSpillovers
+
+def runSweepWorker(queueFolder,workerId=None,leaseSeconds=600,maxAttempts=3,pollSeconds=5):
+	# take units from the queue until no unit is left in todo or leased
+	workerId = str(os.getpid()) if workerId is None else workerId
+	while True:
+		requeueExpiredSweepUnits(queueFolder,leaseSeconds,maxAttempts)
+		unit = claimSweepUnit(queueFolder)
+		if unit is None:
+			if len(os.listdir(getSweepFolder(queueFolder,'todo'))) == 0 and len(os.listdir(getSweepFolder(queueFolder,'leased'))) == 0:
+				return True
+			time.sleep(pollSeconds)
+			continue
+
+		leaseFile = os.path.join(queueFolder,'leased',unit['unitId']+'.json')
+		if loadCheckpoint(getSweepFolder(queueFolder,'results'),unit['unitId'],unit['fingerprint']) is not None:
+			# requeued after its lease expired, but finished meanwhile
+			os.remove(leaseFile)
+			continue
+
+		print('worker '+workerId+': '+unit['unitId'])
+		heartbeat = threading.Event()
+		def renewLease():
+			while not heartbeat.wait(leaseSeconds/3):
+				try:
+					os.utime(leaseFile)
+				except FileNotFoundError:
+					# released, or dropped by a new sweep
+					pass
+		thread = threading.Thread(target=renewLease,daemon=True)
+		thread.start()
+		try:
+			rollingSpillovers = calcSweepUnit(queueFolder,unit)
+			saveCheckpoint(getSweepFolder(queueFolder,'results'),unit['unitId'],unit['fingerprint'],rollingSpillovers)
+			if os.path.exists(leaseFile):
+				os.remove(leaseFile)
+		except Exception as e:
+			print('worker '+workerId+': '+unit['unitId']+' failed, '+repr(e))
+			releaseSweepUnit(queueFolder,unit,maxAttempts)
+		finally:
+			heartbeat.set()
+			thread.join()
+
+def waitSweepUnits(queueFolder,units,leaseSeconds=600,maxAttempts=3,pollSeconds=5):
+	# coordinator: wait until every unit has a result, the expired leases are requeued meanwhile
+	# the unitId holds the fingerprint of the sweep, a result of the same unitId is a result of this sweep
+	while True:
+		requeueExpiredSweepUnits(queueFolder,leaseSeconds,maxAttempts)
+		failed = [unit['unitId'] for unit in units if os.path.exists(os.path.join(queueFolder,'failed',unit['unitId']+'.json'))]
+		if len(failed) > 0:
+			raise RuntimeError('sweep units failed: '+', '.join(failed))
+		done = [unit['unitId'] for unit in units if os.path.exists(os.path.join(queueFolder,'results',unit['unitId']+'.pkl'))]
+		if len(done) == len(units):
+			return True
+		time.sleep(pollSeconds)
+
+def mergeSweepResults(queueFolder,variants,units):
+	# return sweepSpillovers[(lag_order, forecast_horizon, rollingWindow)]: the calcRollingSpillovers structure of each variant
+	sweepSpillovers = {}
+	for lag_order, forecast_horizon, rollingWindow in variants:
+		parts = []
+		for unit in units:
+			if (unit['lag_order'],unit['forecast_horizon'],unit['rollingWindow']) != (lag_order,forecast_horizon,rollingWindow):
+				continue
+			part = loadCheckpoint(getSweepFolder(queueFolder,'results'),unit['unitId'],unit['fingerprint'])
+			if part is None:
+				raise ValueError('no result of this sweep for the unit '+unit['unitId'])
+			if len(part['total']) != unit['end']-unit['start']:
+				raise ValueError('the result of the unit '+unit['unitId']+' has '+str(len(part['total']))+' rolling dates instead of '+str(unit['end']-unit['start']))
+			parts.append((unit['start'],part))
+		parts = [part for start, part in sorted(parts,key=lambda item: item[0])]
+		rollingSpillovers = {}
+		for key in ['total','to','from','net']:
+			rollingSpillovers[key] = pd.concat([part[key] for part in parts])
+		for key in ['pairwiseTo','pairwiseNet','stats','correlation']:
+			if key not in parts[0]:
+				# withStats only
+				continue
+			rollingSpillovers[key] = {}
+			for sector in parts[0][key]:
+				rollingSpillovers[key][sector] = pd.concat([part[key][sector] for part in parts])
+		sweepSpillovers[(lag_order,forecast_horizon,rollingWindow)] = rollingSpillovers
+	return sweepSpillovers
+
+# ==============================
+# BACKGROUND OUTPUT
+# ==============================
+class BackgroundWriter:
+	# Run the output jobs (csv table, chart) in background threads while the next stage keeps computing.
+	# The queue is bounded (maxQueue): when the writers are behind, submit() blocks the computation
+	# instead of piling up results in memory.
+	def __init__(self,maxWorkers=2,maxQueue=16):
+		self.jobs = queue.Queue(maxsize=maxQueue)
+		self.errors = []
+		self.threads = []
+		for i in range(maxWorkers):
+			thread = threading.Thread(target=self._run,daemon=True)
+			thread.start()
+			self.threads.append(thread)
+
+	def _run(self):
+		while True:
+			job = self.jobs.get()
+			if job is None:
+				self.jobs.task_done()
+				return
+			fn, args, kwargs = job
+			try:
+				fn(*args,**kwargs)
+			except Exception as e:
+				self.errors.append(e)
+			finally:
+				self.jobs.task_done()
+
+	def _raiseErrors(self):
+		if len(self.errors) > 0:
+			raise self.errors[0]
+
+	def submit(self,fn,*args,**kwargs):
+		self._raiseErrors()
+		self.jobs.put((fn,args,kwargs))
+
+	def join(self):
+		# wait until every submitted job has been written
+		self.jobs.join()
+		self._raiseErrors()
+
+	def close(self):
+		for thread in self.threads:
+			self.jobs.put(None)
+		for thread in self.threads:
+			thread.join()
+		self._raiseErrors()
+
+def submitJob(writer,fn,*args,**kwargs):
+	# writer is a BackgroundWriter, if writer is None the job is run directly
+	if writer is None:
+		fn(*args,**kwargs)
+	else:
+		writer.submit(fn,*args,**kwargs)
+	return True
+
+def exportTitledTable(df,filename,title):
+	with open(filename,'w') as out:
+		out.write(title)
+	df.to_csv(filename,mode='a')
+	return True
+
 # ==============================
 # CHARTING
 # ==============================
-def genStackedTimeSeriesChart(df,filename,xaxis_title,yaxis_title):
+def calcLTTB(x,y,threshold):
+	# Largest-Triangle-Three-Buckets downsampling (Steinarsson 2013)
+	# keep threshold points of (x, y) that preserve the visual shape of the line, return the index of the kept points
+	# threshold None or NaN (blank chartMaxPoints cell): no downsampling
+	n = len(y)
+	if threshold is None or pd.isna(threshold) or int(threshold) < 3 or int(threshold) >= n:
+		return np.arange(n)
+	threshold = int(threshold)
+	x = np.asarray(x,dtype=float)
+	y = np.nan_to_num(np.asarray(y,dtype=float))
+	every = (n-2)/(threshold-2)
+	index = np.zeros(threshold,dtype=int)
+	a = 0
+	for i in range(threshold-2):
+		start = int(i*every)+1
+		end = int((i+1)*every)+1
+		nextEnd = min(int((i+2)*every)+1,n)
+		avgX = x[end:nextEnd].mean()
+		avgY = y[end:nextEnd].mean()
+		area = np.abs((x[a]-avgX)*(y[start:end]-y[a]) - (x[a]-x[start:end])*(avgY-y[a]))
+		a = start + int(np.argmax(area))
+		index[i+1] = a
+	index[-1] = n-1
+	return index
+
+def getChartIndex(df,chartFormat='PNG',maxPoints=None):
+	# HTML: the positions kept by LTTB in any column of df, maxPoints in total,
+	# shared by the columns drawn together (the max/min band and the median of a range chart)
+	if chartFormat != 'HTML' or maxPoints is None or pd.isna(maxPoints):
+		return np.arange(len(df))
+	if isinstance(df.index,pd.DatetimeIndex):
+		x = df.index.asi8
+	else:
+		x = np.arange(len(df))
+	threshold = max(3,int(maxPoints)//df.shape[1])
+	index = [calcLTTB(x,df[column].to_numpy(dtype=float),threshold) for column in df]
+	return np.unique(np.concatenate(index))
+
+def getChartData(series,chartFormat='PNG',maxPoints=None,index=None):
+	# PNG: the series as it is
+	# HTML: the series is downsampled to maxPoints with LTTB and stored compactly (date string, rounded values)
+	# index: the positions to keep (see getChartIndex) instead of the LTTB of the series
+	if chartFormat != 'HTML':
+		return series.index, series
+	if index is None:
+		if isinstance(series.index,pd.DatetimeIndex):
+			x = series.index.asi8
+		else:
+			x = np.arange(len(series))
+		index = calcLTTB(x,series.to_numpy(dtype=float),maxPoints)
+	series = series.iloc[index]
+	if isinstance(series.index,pd.DatetimeIndex):
+		x = series.index.strftime('%Y-%m-%d').to_numpy()
+	else:
+		x = series.index.to_numpy()
+	y = np.round(series.to_numpy(dtype=float),4)
+	return x, y
+
+def writeChart(fig,filename,width=1400,height=1050,chartFormat='PNG'):
+	# filename is relative to the output folder and without extension
+	# HTML: plotly.min.js is copied once to each output folder and shared by every chart in it (include_plotlyjs='directory')
+	if chartFormat == 'HTML':
+		fig.write_html('output\\'+filename+'.html',include_plotlyjs='directory',default_width=width,default_height=height)
+	else:
+		fig.write_image('output\\'+filename+'.png',width=width,height=height)
+	return True
+
+def genStackedTimeSeriesChart(df,filename,xaxis_title,yaxis_title,chartFormat='PNG',maxPoints=None):
 	fig = go.Figure()
 	for column in df:
+		x, y = getChartData(df[column],chartFormat,maxPoints)
 		fig.add_trace(go.Scatter( \
-			x=df.index, \
-			y=df[column], \
+			x=x, \
+			y=y, \
 			name=column \
 		))
 	fig.update_layout(title={'text':filename, 'x':0.5})
@@ -240,30 +1270,36 @@ def genStackedTimeSeriesChart(df,filename,xaxis_title,yaxis_title):
 		yaxis_title = yaxis_title, \
 		template = 'plotly_white' \
 	)
-	fig.write_image('output\\'+filename+'.png',width=1400,height=1050)
+	writeChart(fig,filename,1400,1050,chartFormat)
+	return True
+
+def genTimeSeriesChart(series,filename,xaxis_title,yaxis_title,chartFormat='PNG',maxPoints=None):
+	fig = go.Figure()
+	x, y = getChartData(series,chartFormat,maxPoints)
+	fig.add_trace(go.Scatter( \
+		x=x, \
+		y=y, \
+		fill = 'tozeroy', \
+		name=filename \
+	))
+	fig.update_layout(title={'text':filename, 'x':0.5})
+	fig.update_layout(showlegend=False)
+	fig.update_layout(margin=dict(l=50,r=50,b=100,t=50,pad=0))
+	fig.update_layout( \
+		xaxis_title = xaxis_title, \
+		yaxis_title = yaxis_title, \
+		template = 'plotly_white' \
+	)
+	writeChart(fig,filename,1400,1050,chartFormat)
 	return True
 
-def genBulkTimeSeriesChart(outputDict,filenameDict,xaxis_title,yaxis_title):
+def genBulkTimeSeriesChart(outputDict,filenameDict,xaxis_title,yaxis_title,writer=None,chartFormat='PNG',maxPoints=None):
+	# writer is an optional BackgroundWriter, each chart is handed to it as a separate job
 	for key in outputDict:
-		fig = go.Figure()
-		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key], \
-			fill = 'tozeroy', \
-			name=filenameDict[key] \
-		))
-		fig.update_layout(title={'text':filenameDict[key], 'x':0.5})
-		fig.update_layout(showlegend=False)
-		fig.update_layout(margin=dict(l=50,r=50,b=100,t=50,pad=0))
-		fig.update_layout( \
-			xaxis_title = xaxis_title, \
-			yaxis_title = yaxis_title, \
-			template = 'plotly_white' \
-		)
-		fig.write_image('output\\'+filenameDict[key]+'.png',width=1400,height=1050)
+		submitJob(writer,genTimeSeriesChart,outputDict[key],filenameDict[key],xaxis_title,yaxis_title,chartFormat,maxPoints)
 	return True
 
-def genSubplotsTimeSeriesChart(outputDict,chartNameDict,xaxis_title,yaxis_title,filename,chartCol=4):
+def genSubplotsTimeSeriesChart(outputDict,chartNameDict,xaxis_title,yaxis_title,filename,chartCol=4,chartFormat='PNG',maxPoints=None):
 	chartCol = 4 if chartCol is None else chartCol
 	nCharts = len(outputDict)
 	chartRow = int(nCharts/chartCol)
@@ -276,9 +1312,10 @@ def genSubplotsTimeSeriesChart(outputDict,chartNameDict,xaxis_title,yaxis_title,
 	rowPos = 1
 	colPos = 1
 	for key in outputDict:
+		x, y = getChartData(outputDict[key],chartFormat,maxPoints)
 		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key], \
+			x=x, \
+			y=y, \
 			fill = 'tozeroy', \
 			name=chartNameDict[key] \
 		),row=rowPos,col=colPos)
@@ -295,49 +1332,57 @@ def genSubplotsTimeSeriesChart(outputDict,chartNameDict,xaxis_title,yaxis_title,
 	)
 	fig.update_layout(font_size=20)
 	fig.update_annotations(font_size=30)
-	fig.write_image('output\\'+filename+'.png',width=1400*chartCol,height=1050*chartRow)
+	writeChart(fig,filename,1400*chartCol,1050*chartRow,chartFormat)
 	return True
 
-def genBulkRangeChart(outputDict,filenameDict,xaxis_title,yaxis_title,folder=''):
-	folder = '' if folder =='' else folder
+def genRangeChart(df,filename,xaxis_title,yaxis_title,folder='',chartFormat='PNG',maxPoints=None):
+	fig = go.Figure()
+	index = getChartIndex(df[['max','min','median']],chartFormat,maxPoints)
+	x, y = getChartData(df['max'],chartFormat,maxPoints,index)
+	fig.add_trace(go.Scatter( \
+		x=x, \
+		y=y, \
+		mode = 'lines', \
+		line_color = 'rgb(136,204,238)', \
+		name=filename \
+	))
+	x, y = getChartData(df['min'],chartFormat,maxPoints,index)
+	fig.add_trace(go.Scatter( \
+		x=x, \
+		y=y, \
+		fill = 'tonexty', \
+		mode = 'lines', \
+		line_color = 'rgb(136,204,238)', \
+		name=filename \
+	))
+	x, y = getChartData(df['median'],chartFormat,maxPoints,index)
+	fig.add_trace(go.Scatter( \
+		x=x, \
+		y=y, \
+		mode = 'lines', \
+		line_color = 'blue', \
+		name=filename \
+	))
 
-	for key in outputDict:
-		fig = go.Figure()
-		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key]['max'], \
-			mode = 'lines', \
-			line_color = 'rgb(136,204,238)', \
-			name=filenameDict[key] \
-		))
-		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key]['min'], \
-			fill = 'tonexty', \
-			mode = 'lines', \
-			line_color = 'rgb(136,204,238)', \
-			name=filenameDict[key] \
-		))
-		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key]['median'], \
-			mode = 'lines', \
-			line_color = 'blue', \
-			name=filenameDict[key] \
-		))
+	fig.update_layout(title={'text':filename, 'x':0.5})
+	fig.update_layout(showlegend=False)
+	fig.update_layout(margin=dict(l=50,r=50,b=100,t=50,pad=0))
+	fig.update_layout( \
+		xaxis_title = xaxis_title, \
+		yaxis_title = yaxis_title, \
+		template = 'plotly_white' \
+	)
+	writeChart(fig,folder+filename,1400,1050,chartFormat)
+	return True
 
-		fig.update_layout(title={'text':filenameDict[key], 'x':0.5})
-		fig.update_layout(showlegend=False)
-		fig.update_layout(margin=dict(l=50,r=50,b=100,t=50,pad=0))
-		fig.update_layout( \
-			xaxis_title = xaxis_title, \
-			yaxis_title = yaxis_title, \
-			template = 'plotly_white' \
-		)
-		fig.write_image('output\\'+folder+filenameDict[key]+'.png',width=1400,height=1050)
+def genBulkRangeChart(outputDict,filenameDict,xaxis_title,yaxis_title,folder='',writer=None,chartFormat='PNG',maxPoints=None):
+	folder = '' if folder =='' else folder
+	# writer is an optional BackgroundWriter, each chart is handed to it as a separate job
+	for key in outputDict:
+		submitJob(writer,genRangeChart,outputDict[key],filenameDict[key],xaxis_title,yaxis_title,folder,chartFormat,maxPoints)
 	return True
 
-def genSubplotsRangeChart(outputDict,chartNameDict,xaxis_title,yaxis_title,filename,chartCol=4):
+def genSubplotsRangeChart(outputDict,chartNameDict,xaxis_title,yaxis_title,filename,chartCol=4,chartFormat='PNG',maxPoints=None):
 	chartCol = 4 if chartCol is None else chartCol
 	nCharts = len(outputDict)
 	chartRow = int(nCharts/chartCol)
@@ -350,24 +1395,28 @@ def genSubplotsRangeChart(outputDict,chartNameDict,xaxis_title,yaxis_title,filen
 	rowPos = 1
 	colPos = 1
 	for key in outputDict:
+		index = getChartIndex(outputDict[key][['max','min','median']],chartFormat,maxPoints)
+		x, y = getChartData(outputDict[key]['max'],chartFormat,maxPoints,index)
 		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key]['max'], \
+			x=x, \
+			y=y, \
 			mode = 'lines', \
 			line_color = 'rgb(136,204,238)', \
 			name=chartNameDict[key] \
 		),row=rowPos,col=colPos)
+		x, y = getChartData(outputDict[key]['min'],chartFormat,maxPoints,index)
 		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key]['min'], \
+			x=x, \
+			y=y, \
 			fill = 'tonexty', \
 			mode = 'lines', \
 			line_color = 'rgb(136,204,238)', \
 			name=chartNameDict[key] \
 		),row=rowPos,col=colPos)
+		x, y = getChartData(outputDict[key]['median'],chartFormat,maxPoints,index)
 		fig.add_trace(go.Scatter( \
-			x=outputDict[key].index, \
-			y=outputDict[key]['median'], \
+			x=x, \
+			y=y, \
 			mode = 'lines', \
 			line_color = 'blue', \
 			name=chartNameDict[key] \
@@ -387,5 +1436,5 @@ def genSubplotsRangeChart(outputDict,chartNameDict,xaxis_title,yaxis_title,filen
 	)
 	fig.update_layout(font_size=20)
 	fig.update_annotations(font_size=30)
-	fig.write_image('output\\'+filename+'.png',width=1400*chartCol,height=1050*chartRow)
+	writeChart(fig,filename,1400*chartCol,1050*chartRow,chartFormat)
 	return True
\ No newline at end of file
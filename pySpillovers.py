@@ -3,6 +3,7 @@
 # ==============================
 import pandas as pd, numpy as np
 import math
+import multiprocessing
 import functions as f
 
 from pathlib import Path
@@ -12,7 +13,27 @@ warnings.filterwarnings("ignore")
 # ===================================================================================================
 # ============================================IMPORT DATA============================================
 # ===================================================================================================
-def getImportData(marketDaysMode=None,marketDaysYearEnd=250,manualMarketDays=250):
+def getSetting(df,setting,default=None):
+	# optional settings: an older _userInput.xlsx without the setting row keeps the default
+	return df.loc[setting,'VALUE'] if setting in df.index else default
+
+def getPricesFolder(dataSource=None):
+	return 'IntradayDaily\\' if dataSource == 'Intraday' else 'DailyPrices\\'
+
+def getIntradayIngestion():
+	# ==============================
+	# USER INPUT
+	# ==============================
+	df = pd.read_excel('_userInput.xlsx').set_index("SETTINGS")
+	chunksize = int(getSetting(df,'intradayChunkSize',1000000))
+
+	# Aggregate IntradayPrices\<sector>\*.csv into the daily panel IntradayDaily\<sector>.JK_D.csv
+	sectors = np.genfromtxt('_sectorsList.csv',delimiter=',',dtype="str")
+	Path("IntradayDaily").mkdir(parents=True, exist_ok=True)
+	f.calcIntradayDailyPanel(sectors,'IntradayPrices\\','IntradayDaily\\',chunksize)
+	return True
+
+def getImportData(marketDaysMode=None,marketDaysYearEnd=250,manualMarketDays=250,pricesFolder='DailyPrices\\'):
 	marketDaysMode = None if marketDaysMode is None else marketDaysMode
 	marketDaysYearEnd = 250 if marketDaysYearEnd is None else marketDaysYearEnd
 	manualMarketDays = 250 if manualMarketDays is None else manualMarketDays
@@ -20,16 +41,10 @@ def getImportData(marketDaysMode=None,marketDaysYearEnd=250,manualMarketDays=250
 	# Import sectors
 	sectors = np.genfromtxt('_sectorsList.csv',delimiter=',',dtype="str")
 
-	# Import sectorsData, reIndex sectorsData with Date
-	rawSectorsData = {}
+	# Import sectorsData (read concurrently), reIndex sectorsData with Date
+	rawSectorsData = f.readSectorsData(sectors,pricesFolder)
 	marketDays = {}
 	for sector in sectors:
-		# rawSectorsData
-		df = pd.read_csv('DailyPrices\\'+sector+'.JK_D.csv') \
-			.assign(Date=lambda x: pd.to_datetime(x.Date, format="%d-%m-%Y")) \
-			.set_index("Date")
-		rawSectorsData[sector] = df
-
 		# marketDays
 		if marketDaysMode == "Manual":
 			marketDays = manualMarketDays
@@ -40,7 +55,7 @@ def getImportData(marketDaysMode=None,marketDaysYearEnd=250,manualMarketDays=250
 # ===================================================================================================
 # ============Average and Dynamic Spillovers With Constant Lag Order and Forecast Horizon============
 # ===================================================================================================
-def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None):
+def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None,writer=None):
 	# ==============================
 	# USER INPUT
 	# ==============================
@@ -53,6 +68,10 @@ def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None):
 	dataYearEnd = df.loc['dataYearEnd','VALUE']
 	marketDaysYearEnd = df.loc['marketDaysYearEnd','VALUE']
 	rollingWindow = df.loc['rollingWindow','VALUE']
+	dataSource = getSetting(df,'dataSource','Daily')
+	varianceEstimator = getSetting(df,'varianceEstimator','Parkinson')
+	chartFormat = getSetting(df,'chartFormat','PNG')
+	chartMaxPoints = getSetting(df,'chartMaxPoints',None)
 	
 	lag_order = df.loc['lag_order','VALUE'] if lag_order is None else lag_order
 	forecast_horizon = df.loc['forecast_horizon','VALUE'] if forecast_horizon is None else forecast_horizon
@@ -64,7 +83,7 @@ def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None):
 	# ==============================
 	# IMPORT DATA
 	# ==============================
-	rawSectorsData, marketDays, sectors = getImportData(marketDaysMode,marketDaysYearEnd,manualMarketDays)
+	rawSectorsData, marketDays, sectors = getImportData(marketDaysMode,marketDaysYearEnd,manualMarketDays,getPricesFolder(dataSource))
 	sectorsData = {}
 	for sector in sectors:
 		sectorsData[sector] = rawSectorsData[sector].loc[dateFrom:dateTo]
@@ -73,7 +92,7 @@ def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None):
 	# DATA PREPARATION BASED ON OUTPUTMODE
 	# ==============================
 	lnreturn = f.calcLnreturn(sectorsData)
-	lnvariance = f.calcLnvariance(sectorsData)
+	lnvariance = f.calcLnvariance(sectorsData,varianceEstimator)
 
 	if outputMode == "Volatility Diebold":
 		volatility = f.calcVolatilityDiebold(lnvariance.copy(),marketDays.copy())
@@ -98,22 +117,25 @@ def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None):
 	# ==============================
 	# OUTPUT
 	# ==============================
+	# writer is an optional f.BackgroundWriter, the output is written while the next stage computes
 	# setStats
-	setStats.to_csv('output\setStats.csv')
+	f.submitJob(writer,setStats.to_csv,'output\setStats.csv')
 
 	# correlationTable
-	correlationTable.to_csv('output\correlationTable.csv')
+	f.submitJob(writer,correlationTable.to_csv,'output\correlationTable.csv')
 	
 	# Volatility Table
-	lnreturn.to_csv('output\\lnreturn.csv')
-	volatility.to_csv('output\\volatility.csv')
+	f.submitJob(writer,lnreturn.to_csv,'output\\lnreturn.csv')
+	f.submitJob(writer,volatility.to_csv,'output\\volatility.csv')
 
 	# Volatility Graph
-	f.genStackedTimeSeriesChart(\
+	f.submitJob(writer,f.genStackedTimeSeriesChart,\
 		df=volatility, \
 		filename='Volatilities (Annualized Standard Deviations)', \
 		xaxis_title = 'Date', \
-		yaxis_title = '%' \
+		yaxis_title = '%', \
+		chartFormat = chartFormat, \
+		maxPoints = chartMaxPoints \
 	)
 
 	# Data Spillover Table
@@ -121,25 +143,22 @@ def getAvgSpillovers(lag_order=None,forecast_horizon=None,output=None):
 	title = 'Spillover Table\n'
 	title = title + 'lag_order,' + str(lag_order) + '\nforecast_horizon,' + str(forecast_horizon) + '\n'
 	title = title + 'TO,FROM\n'
-	with open(filename,'w') as out:
-		out.write(title)
-	spilloversTable.to_csv(filename,mode='a')
+	f.submitJob(writer,f.exportTitledTable,spilloversTable,filename,title)
 
 	return spilloversTable, setStats, volatility, lnvariance, lag_order, forecast_horizon
 
-def getRollingSpillovers(lag_order=None,forecast_horizon=None,output=None):
+def getRollingSpillovers(lag_order=None,forecast_horizon=None,output=None,withStats=False):
 	# ==============================
 	# USER INPUT
 	# ==============================
 	df = pd.read_excel('_userInput.xlsx').set_index("SETTINGS")
-	dateFrom = df.loc['dateFrom','VALUE']
-	dateTo = df.loc['dateTo','VALUE']
-	outputMode = df.loc['outputMode','VALUE']
-	marketDaysMode = df.loc['marketDaysMode','VALUE']
-	manualMarketDays = df.loc['manualMarketDays','VALUE']
-	dataYearEnd = df.loc['dataYearEnd','VALUE']
-	marketDaysYearEnd = df.loc['marketDaysYearEnd','VALUE']
 	rollingWindow = df.loc['rollingWindow','VALUE']
+	spilloversModel = getSetting(df,'spilloversModel','Rolling')
+	kappa1 = getSetting(df,'kappa1',0.99)
+	kappa2 = getSetting(df,'kappa2',0.96)
+	checkpointEvery = getSetting(df,'checkpointEvery',0)
+	spilloversBackend = getSetting(df,'spilloversBackend','statsmodels')
+	backendCheckWindows = getSetting(df,'backendCheckWindows',0)
 	
 	lag_order = df.loc['lag_order','VALUE'] if lag_order is None else lag_order
 	forecast_horizon = df.loc['forecast_horizon','VALUE'] if forecast_horizon is None else forecast_horizon
@@ -147,40 +166,102 @@ def getRollingSpillovers(lag_order=None,forecast_horizon=None,output=None):
 	lag_order = None if lag_order =='Auto' else lag_order
 	forecast_horizon = None if forecast_horizon =='Auto' else forecast_horizon
 	rollingWindow = None if rollingWindow =='Auto' else rollingWindow
+
+	# TVP-VAR has no rolling window, only the lag_order observations before dateFrom are needed
+	historyWindow = rollingWindow
+	if spilloversModel == 'TVP-VAR':
+		historyWindow = 2 if lag_order is None else lag_order+1
 	# ==============================
 	# IMPORT DATA
 	# ==============================
-	rawSectorsData, marketDays, sectors = getImportData(marketDaysMode,marketDaysYearEnd,manualMarketDays)
+	volatility, lnvariance = getRollingVolatility(historyWindow)
+
+	# ==============================
+	# TOTAL, DIRECTIONAL, NET ROLLING SPILLOVERS
+	# ==============================
+	# rolling Spillovers: 
+	# ['total']
+	# ['to'][sector]
+	# ['from'][sector]
+	# ['net'][sector]
+	# ['pairwiseTo'][sectorTo][sectorFrom]
+	# ['pairwiseNet'][sectorTo][sectorFrom]
+	if spilloversModel == 'TVP-VAR':
+		rollingSpillovers = f.calcTVPVARSpillovers(volatility, forecast_horizon, lag_order, kappa1, kappa2)
+	else:
+		# checkpoint of the finished windows, output is the name of the run (example: sensitivity_lag_order_3)
+		stateFolder = 'output\\_state\\' if checkpointEvery > 0 else None
+		checkpointKey = 'rolling' if output is None else output
+		# the backend is compared with the reference statsmodels backend on the first backendCheckWindows windows,
+		# once on the main rolling run (output is None), not again for every sensitivity variant
+		if spilloversBackend != 'statsmodels' and backendCheckWindows > 0 and output is None:
+			difference = f.checkSpilloversBackends(volatility, forecast_horizon, lag_order, rollingWindow, spilloversBackend, 'statsmodels', backendCheckWindows)
+			print('spilloversBackend '+spilloversBackend+' (compiled kernel: '+str(f.calcRollingFevdKernelJit is not None)+') vs statsmodels, max difference: '+str(difference))
+		# withStats: rolling statistics of the windows for exportRollingStats, only for the main rolling run
+		rollingSpillovers = f.calcRollingSpillovers(volatility, forecast_horizon, lag_order,rollingWindow,stateFolder,checkpointKey,checkpointEvery,spilloversBackend,withStats)
+
+	return rollingSpillovers, volatility, lnvariance, lag_order, forecast_horizon
+
+def getRollingVolatility(historyWindow=200):
+	# volatility and lnvariance between dateFrom and dateTo, with historyWindow-1 observations before dateFrom
+	# shared by the rolling run, the rolling window sweep and the distributed sweep
+	# ==============================
+	# USER INPUT
+	# ==============================
+	df = pd.read_excel('_userInput.xlsx').set_index("SETTINGS")
+	dateFrom = df.loc['dateFrom','VALUE']
+	dateTo = df.loc['dateTo','VALUE']
+	outputMode = df.loc['outputMode','VALUE']
+	marketDaysMode = df.loc['marketDaysMode','VALUE']
+	manualMarketDays = df.loc['manualMarketDays','VALUE']
+	marketDaysYearEnd = df.loc['marketDaysYearEnd','VALUE']
+	dataSource = getSetting(df,'dataSource','Daily')
+	varianceEstimator = getSetting(df,'varianceEstimator','Parkinson')
+	# ==============================
+	# IMPORT DATA
+	# ==============================
+	rawSectorsData, marketDays, sectors = getImportData(marketDaysMode,marketDaysYearEnd,manualMarketDays,getPricesFolder(dataSource))
 	sectorsData = {}
 	for sector in sectors:
-		# Filter sectorsData between DateTo and DateFrom
-		sectorsData[sector] = f.getWithRollingWindow(rawSectorsData[sector],dateFrom,dateTo,rollingWindow)
+		# Filter sectorsData between DateTo and DateFrom, with the history of historyWindow
+		sectorsData[sector] = f.getWithRollingWindow(rawSectorsData[sector],dateFrom,dateTo,historyWindow)
 
 	# ==============================
 	# DATA PREPARATION BASED ON OUTPUTMODE
 	# ==============================
-	lnvariance = f.calcLnvariance(sectorsData)
+	lnvariance = f.calcLnvariance(sectorsData,varianceEstimator)
 
 	if outputMode == "Volatility Diebold":
 		volatility = f.calcVolatilityDiebold(lnvariance.copy(),marketDays.copy())
 	elif outputMode == "Volatility Aslam":
 		volatility = f.calcVolatilityAslam(lnvariance.copy(),marketDays.copy())
 
+	return volatility, lnvariance
+
+def getRollingWindowSweep(rollingWindows,lag_order=None,forecast_horizon=None):
 	# ==============================
-	# TOTAL, DIRECTIONAL, NET ROLLING SPILLOVERS
+	# USER INPUT
 	# ==============================
-	# rolling Spillovers: 
-	# ['total']
-	# ['to'][sector]
-	# ['from'][sector]
-	# ['net'][sector]
-	# ['pairwiseTo'][sectorTo][sectorFrom]
-	# ['pairwiseNet'][sectorTo][sectorFrom]
-	rollingSpillovers = f.calcRollingSpillovers(volatility, forecast_horizon, lag_order,rollingWindow)
+	df = pd.read_excel('_userInput.xlsx').set_index("SETTINGS")
+	lag_order = df.loc['lag_order','VALUE'] if lag_order is None else lag_order
+	forecast_horizon = df.loc['forecast_horizon','VALUE'] if forecast_horizon is None else forecast_horizon
 
-	return rollingSpillovers, volatility, lnvariance, lag_order, forecast_horizon
+	lag_order = None if lag_order =='Auto' else lag_order
+	forecast_horizon = None if forecast_horizon =='Auto' else forecast_horizon
+
+	# volatility with the history of the longest rolling window
+	volatility, lnvariance = getRollingVolatility(max(rollingWindows))
+	del lnvariance
 
-def exportRollingSpillovers(rollingSpillovers,sectors):
+	# ==============================
+	# ROLLING SPILLOVERS FOR EACH ROLLING WINDOW
+	# ==============================
+	# sweepSpillovers[rollingWindow]: same structure as the rolling Spillovers
+	sweepSpillovers = f.calcRollingWindowSweep(volatility, rollingWindows, forecast_horizon, lag_order)
+
+	return sweepSpillovers
+
+def exportRollingSpillovers(rollingSpillovers,sectors,writer=None,chartFormat='PNG',maxPoints=None):
 	# ==============================
 	# OUTPUT
 	# ==============================
@@ -198,13 +279,15 @@ def exportRollingSpillovers(rollingSpillovers,sectors):
 		filenameDict['to_'+column] = 'Rolling Directional Volatility Spillovers '+column+' - TO OTHERS'
 		subplotsOutputDict['to_'+column] = rollingSpillovers['to'][column]
 		subplotsfilenameDict['to_'+column] = 'Rolling Directional Volatility Spillovers '+column+'- TO OTHERS'
-	f.genSubplotsTimeSeriesChart( \
+	f.submitJob(writer,f.genSubplotsTimeSeriesChart, \
 		subplotsOutputDict, \
 		chartNameDict=subplotsfilenameDict, \
 		xaxis_title='Date', \
 		yaxis_title='%', \
 		filename='Rolling Directional Volatility Spillovers All Sectors - TO OTHERS', \
-		chartCol=3
+		chartCol=3, \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints
 	)
 	subplotsOutputDict = {}
 	subplotsfilenameDict = {}
@@ -214,13 +297,15 @@ def exportRollingSpillovers(rollingSpillovers,sectors):
 		filenameDict['from_'+column] = 'Rolling Directional Volatility Spillovers '+column+' - FROM OTHERS'
 		subplotsOutputDict['from_'+column] = rollingSpillovers['from'][column]
 		subplotsfilenameDict['from_'+column] = 'Rolling Directional Volatility Spillovers '+column+' - FROM OTHERS'
-	f.genSubplotsTimeSeriesChart( \
+	f.submitJob(writer,f.genSubplotsTimeSeriesChart, \
 		subplotsOutputDict, \
 		chartNameDict=subplotsfilenameDict, \
 		xaxis_title='Date', \
 		yaxis_title='%', \
 		filename='Rolling Directional Volatility Spillovers All Sectors - FROM OTHERS', \
-		chartCol=3
+		chartCol=3, \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints
 	)
 	subplotsOutputDict = {}
 	subplotsfilenameDict = {}
@@ -230,13 +315,15 @@ def exportRollingSpillovers(rollingSpillovers,sectors):
 		filenameDict['net_'+column] = 'Rolling Directional Volatility Spillovers '+column+' - NET'
 		subplotsOutputDict['net_'+column] = rollingSpillovers['net'][column]
 		subplotsfilenameDict['net_'+column] = 'Rolling Directional Volatility Spillovers '+column+' - NET'
-	f.genSubplotsTimeSeriesChart( \
+	f.submitJob(writer,f.genSubplotsTimeSeriesChart, \
 		subplotsOutputDict, \
 		chartNameDict=subplotsfilenameDict, \
 		xaxis_title='Date', \
 		yaxis_title='%', \
 		filename='Rolling Directional Volatility Spillovers All Sectors - NET', \
-		chartCol=3
+		chartCol=3, \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints
 	)
 	subplotsOutputDict = {}
 	subplotsfilenameDict = {}
@@ -277,7 +364,7 @@ def exportRollingSpillovers(rollingSpillovers,sectors):
 
 	# GRAPH
 	print('Spitting The Rolling Spillovers Graph...')
-	f.genBulkTimeSeriesChart(outputDict,filenameDict,xaxis_title='Date',yaxis_title='%')
+	f.genBulkTimeSeriesChart(outputDict,filenameDict,xaxis_title='Date',yaxis_title='%',writer=writer,chartFormat=chartFormat,maxPoints=maxPoints)
 	
 	# TABLE
 	print('Export The Rolling Spillovers Table...')
@@ -286,10 +373,77 @@ def exportRollingSpillovers(rollingSpillovers,sectors):
 	for key in filenameDict:
 		header = header + filenameDict[key] + ','
 	header = header + '\n'
-	with open(filename,'w') as out:
-		out.write(header)
 	outputDict = pd.DataFrame.from_dict(outputDict)
-	outputDict.to_csv(filename,mode='a')
+	f.submitJob(writer,f.exportTitledTable,outputDict,filename,header)
+
+	return True
+
+def exportNetworkAnalytics(networkAnalytics,writer=None,chartFormat='PNG',maxPoints=None):
+	# ==============================
+	# OUTPUT
+	# ==============================
+	# networkAnalytics:
+	# ['inStrength'][sector]
+	# ['outStrength'][sector]
+	# ['net'][sector]
+	# ['netRank'][sector]
+	# ['centrality'][sector]
+	# ['density']
+
+	# GRAPH
+	print('Spitting The Rolling Network Analytics Graph...')
+	f.submitJob(writer,f.genStackedTimeSeriesChart, \
+		df=networkAnalytics['centrality'], \
+		filename='Rolling Eigenvector Centrality of Volatility Spillovers Transmitters', \
+		xaxis_title='Date', \
+		yaxis_title='Centrality', \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints \
+	)
+	f.submitJob(writer,f.genTimeSeriesChart, \
+		networkAnalytics['density']['density'], \
+		'Rolling Volatility Spillovers Network Density', \
+		'Date', \
+		'Density', \
+		chartFormat, \
+		maxPoints \
+	)
+
+	# TABLE
+	print('Export The Rolling Network Analytics Table...')
+	filename = 'output\\rollingNetworkAnalyticsTable.csv'
+	df = pd.concat(networkAnalytics,axis=1)
+	f.submitJob(writer,df.to_csv,filename)
+
+	return True
+
+def exportRollingStats(rollingSpillovers,writer=None,chartFormat='PNG',maxPoints=None):
+	# ==============================
+	# OUTPUT
+	# ==============================
+	# statistics of the rolling windows (f.calcRollingSpillovers):
+	# ['stats'][stat][sector]
+	# ['correlation'][sectorA][sectorB]
+
+	# GRAPH
+	print('Spitting The Rolling Statistic Graph...')
+	sectors = list(rollingSpillovers['correlation'].keys())
+	correlation = pd.concat(rollingSpillovers['correlation'],axis=1).astype(float)
+	averageCorrelation = (correlation.sum(axis=1)-len(sectors)) / (len(sectors)*(len(sectors)-1))
+	f.submitJob(writer,f.genTimeSeriesChart, \
+		averageCorrelation, \
+		'Rolling Average Correlation of Volatilities', \
+		'Date', \
+		'Correlation', \
+		chartFormat, \
+		maxPoints \
+	)
+
+	# TABLE
+	print('Export The Rolling Statistic Table...')
+	df = pd.concat(rollingSpillovers['stats'],axis=1)
+	f.submitJob(writer,df.to_csv,'output\\rollingSetStats.csv')
+	f.submitJob(writer,correlation.to_csv,'output\\rollingCorrelationTable.csv')
 
 	return True
 
@@ -297,7 +451,7 @@ def exportRollingSpillovers(rollingSpillovers,sectors):
 # SENSITIVITY ANALYSIS:
 # Average and Dynamic Spillovers With Variant Lag Order
 # ==============================
-def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_horizon,sectors):
+def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_horizon,sectors,writer=None,chartFormat='PNG',maxPoints=None,step=1):
 	# sensitivityRange['total']
 	# sensitivityRange['to'][sector]
 	# sensitivityRange['from'][sector]
@@ -329,7 +483,17 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 	# ==============================
 	# ITERATE FOR EACH VARIANTPARAM
 	# ==============================
-	for i in range(start,end+1,1):
+	# every rolling window is computed in a single pass over the data
+	variants = list(range(start,end+1,step))
+	if variantParam == 'rollingWindow':
+		# the VAR of a window needs more observations (rollingWindow-lag_order) than coefficients per equation (1+n*lag_order)
+		identified = [i for i in variants if i-lag_order > 1+len(sectors)*lag_order]
+		if len(identified) < len(variants):
+			print('Sensitivity Windows Skipped, more VAR coefficients than window observations: '+str(len(variants)-len(identified)))
+		variants = identified
+		sweepSpillovers = getRollingWindowSweep(variants,lag_order,forecast_horizon)
+
+	for i in variants:
 		print('sensitivityAnalysis #'+str(i))
 		if variantParam == 'lag_order':
 			rollingSpillovers, temp1, temp2, temp3, temp4 = getRollingSpillovers(lag_order=i,forecast_horizon=forecast_horizon,output='sensitivity_lag_order_'+str(i))
@@ -337,6 +501,12 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 		elif variantParam == 'forecast_horizon':
 			rollingSpillovers, temp1, temp2, temp3, temp4 = getRollingSpillovers(lag_order=lag_order,forecast_horizon=i,output='sensitivity_forecast_horizon_'+str(i))
 			del temp1, temp2, temp3, temp4
+		elif variantParam == 'rollingWindow':
+			rollingSpillovers = sweepSpillovers.pop(i)
+
+		# the table of the finished variant is written while the next variant computes
+		filename = 'output\\sensitivity_'+variantParam+'\\rollingSpillovers_'+variantParam+'_'+str(i)+'.csv'
+		f.submitJob(writer,exportVariantSpillovers,rollingSpillovers,filename)
 		
 		newRollingSpillovers['total'][i] = rollingSpillovers['total']
 		for sector in sectors:
@@ -352,10 +522,26 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 	# ==============================
 	sensitivityRange = f.calcRollingSensitivityAnalysis(newRollingSpillovers)
 
+	export = exportSensitivityRange(sensitivityRange,sectors,variantParam,writer,chartFormat,maxPoints)
+	return sensitivityRange
+
+def exportVariantSpillovers(rollingSpillovers,filename):
+	# total, to, from, net rolling spillovers of one sensitivity variant in one table
+	df = pd.concat([ \
+		rollingSpillovers['total'].rename(columns={0:'total'}), \
+		rollingSpillovers['to'].add_prefix('to_'), \
+		rollingSpillovers['from'].add_prefix('from_'), \
+		rollingSpillovers['net'].add_prefix('net_') \
+	],axis=1)
+	df.to_csv(filename)
+	return True
+
+def exportSensitivityRange(sensitivityRange,sectors,variantParam,writer=None,chartFormat='PNG',maxPoints=None):
 	# ==============================
 	# OUTPUT
 	# ==============================
 	# Total, FROM, TO, NET, PairwiseTo, PairwiseNet Data Spillover Table and Graph
+	# to the folder output\\sensitivity_<variantParam>
 	outputDict = {}
 	filenameDict = {}
 	subplotsOutputDict = {}
@@ -369,13 +555,15 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 		filenameDict['to_'+column] = 'Sensitivity Range Rolling Directional Volatility Spillovers '+column+' - TO OTHERS'
 		subplotsOutputDict['to_'+column] = sensitivityRange['to'][column]
 		subplotsfilenameDict['to_'+column] = 'Sensitivity Range Rolling Directional Volatility Spillovers '+column+' - TO OTHERS'
-	f.genSubplotsRangeChart( \
+	f.submitJob(writer,f.genSubplotsRangeChart, \
 		subplotsOutputDict, \
 		chartNameDict=subplotsfilenameDict, \
 		xaxis_title='Date', \
 		yaxis_title='%', \
 		filename='sensitivity_'+variantParam+'\\'+'Sensitivity Range Rolling Directional Volatility Spillovers All Sectors - TO OTHERS', \
-		chartCol=3
+		chartCol=3, \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints
 	)
 	subplotsOutputDict = {}
 	subplotsfilenameDict = {}
@@ -385,13 +573,15 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 		filenameDict['from_'+column] = 'Sensitivity Range Rolling Directional Volatility Spillovers '+column+' - FROM OTHERS'
 		subplotsOutputDict['from_'+column] = sensitivityRange['from'][column]
 		subplotsfilenameDict['from_'+column] = 'Sensitivity Range Rolling Directional Volatility Spillovers '+column+' - FROM OTHERS'
-	f.genSubplotsRangeChart( \
+	f.submitJob(writer,f.genSubplotsRangeChart, \
 		subplotsOutputDict, \
 		chartNameDict=subplotsfilenameDict, \
 		xaxis_title='Date', \
 		yaxis_title='%', \
 		filename='sensitivity_'+variantParam+'\\'+'Sensitivity Range Rolling Directional Volatility Spillovers All Sectors - FROM OTHERS', \
-		chartCol=3
+		chartCol=3, \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints
 	)
 	subplotsOutputDict = {}
 	subplotsfilenameDict = {}
@@ -401,13 +591,15 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 		filenameDict['net_'+column] = 'Sensitivity Range Rolling Directional Volatility Spillovers '+column+' - NET'
 		subplotsOutputDict['net_'+column] = sensitivityRange['net'][column]
 		subplotsfilenameDict['net_'+column] = 'Sensitivity Range Rolling Directional Volatility Spillovers '+column+' - NET'
-	f.genSubplotsRangeChart( \
+	f.submitJob(writer,f.genSubplotsRangeChart, \
 		subplotsOutputDict, \
 		chartNameDict=subplotsfilenameDict, \
 		xaxis_title='Date', \
 		yaxis_title='%', \
 		filename='sensitivity_'+variantParam+'\\'+'Sensitivity Range Rolling Directional Volatility Spillovers All Sectors - NET', \
-		chartCol=3
+		chartCol=3, \
+		chartFormat=chartFormat, \
+		maxPoints=maxPoints
 	)
 	subplotsOutputDict = {}
 	subplotsfilenameDict = {}
@@ -448,50 +640,195 @@ def getRollingSensitivityAnalysis(variantParam,start,end,lag_order,forecast_hori
 
 	# GRAPH
 	print('Spitting The Sensitivity Range Rolling Spillovers Graph...')
-	f.genBulkRangeChart(outputDict,filenameDict,xaxis_title='Date',yaxis_title='%',folder='sensitivity_'+variantParam+'\\')
+	f.genBulkRangeChart(outputDict,filenameDict,xaxis_title='Date',yaxis_title='%',folder='sensitivity_'+variantParam+'\\',writer=writer,chartFormat=chartFormat,maxPoints=maxPoints)
 	
 	# TABLE
 	print('Export The Sensitivity Range Rolling Spillovers Table...')
 	filename = 'output\\sensitivity_'+variantParam+'\\sensitivityRangeTable.csv'
 	df = {(outerKey, innerKey): values for outerKey, innerDict in outputDict.items() for innerKey, values in innerDict.iteritems()}
 	df = pd.DataFrame(df)
-	df.to_csv(filename)
+	f.submitJob(writer,df.to_csv,filename)
+	return True
+
+
+# ==============================
+# DISTRIBUTED SENSITIVITY ANALYSIS:
+# Dynamic Spillovers With Variant Lag Order, Forecast Horizon and Rolling Window
+# ==============================
+def getDistributedSensitivityAnalysis(lag_orders,forecast_horizons,rollingWindows,sectors,queueFolder,localWorkers=0,chunkSize=50,leaseSeconds=600,writer=None,chartFormat='PNG',maxPoints=None,backend='statsmodels'):
+	# the grid lag_orders x forecast_horizons x rollingWindows is split in units (variant x chunk of rolling dates)
+	# on the work queue queueFolder, see DISTRIBUTED SWEEP in functions.py
+	# the units are computed by localWorkers processes started here,
+	# and by the workers started on other machines that share queueFolder: python pySweepWorker.py <queueFolder>
+
+	# ==============================
+	# PUBLISH THE UNITS
+	# ==============================
+	variants = [(lag_order,forecast_horizon,rollingWindow) for lag_order in lag_orders for forecast_horizon in forecast_horizons for rollingWindow in rollingWindows]
+	# the VAR of a window needs more observations (rollingWindow-lag_order) than coefficients per equation (1+n*lag_order)
+	identified = [variant for variant in variants if variant[2]-variant[0] > 1+len(sectors)*variant[0]]
+	if len(identified) < len(variants):
+		print('Sweep Variants Skipped, more VAR coefficients than window observations: '+str(len(variants)-len(identified)))
+	variants = identified
+	volatility, lnvariance = getRollingVolatility(max(rollingWindows))
+	del lnvariance
+	units = f.publishSweepUnits(queueFolder,volatility,variants,chunkSize,backend)
+	print('Sweep Units Published: '+str(len(units)))
+
+	# ==============================
+	# WORKERS
+	# ==============================
+	workers = []
+	for i in range(localWorkers):
+		worker = multiprocessing.Process(target=f.runSweepWorker,args=(queueFolder,'local'+str(i),leaseSeconds))
+		worker.start()
+		workers.append(worker)
+	f.waitSweepUnits(queueFolder,units,leaseSeconds)
+	for worker in workers:
+		worker.join()
+
+	# ==============================
+	# MERGE THE UNITS
+	# ==============================
+	sweepSpillovers = f.mergeSweepResults(queueFolder,variants,units)
+
+	newRollingSpillovers = {}
+	newRollingSpillovers['total'] = pd.DataFrame()
+	newRollingSpillovers['to'] = {}
+	newRollingSpillovers['from'] = {}
+	newRollingSpillovers['net'] = {}
+	newRollingSpillovers['pairwiseTo'] = {}
+	newRollingSpillovers['pairwiseNet'] = {}
+	for sector in sectors:
+		newRollingSpillovers['to'][sector] = pd.DataFrame()
+		newRollingSpillovers['from'][sector] = pd.DataFrame()
+		newRollingSpillovers['net'][sector] = pd.DataFrame()
+		newRollingSpillovers['pairwiseTo'][sector] = {}
+		newRollingSpillovers['pairwiseNet'][sector] = {}
+		for sectorFrom in sectors:
+			newRollingSpillovers['pairwiseTo'][sector][sectorFrom] = pd.DataFrame()
+			newRollingSpillovers['pairwiseNet'][sector][sectorFrom] = pd.DataFrame()
+
+	for variant in variants:
+		i = 'p'+str(variant[0])+'_h'+str(variant[1])+'_w'+str(variant[2])
+		rollingSpillovers = sweepSpillovers.pop(variant)
+		newRollingSpillovers['total'][i] = rollingSpillovers['total']
+		for sector in sectors:
+			newRollingSpillovers['to'][sector][i] = rollingSpillovers['to'][sector]
+			newRollingSpillovers['from'][sector][i] = rollingSpillovers['from'][sector]
+			newRollingSpillovers['net'][sector][i] = rollingSpillovers['net'][sector]
+			for sectorFrom in sectors:
+				newRollingSpillovers['pairwiseTo'][sector][sectorFrom][i] = rollingSpillovers['pairwiseTo'][sector][sectorFrom]
+				newRollingSpillovers['pairwiseNet'][sector][sectorFrom][i] = rollingSpillovers['pairwiseNet'][sector][sectorFrom]
+
+	# ==============================
+	# SENSITIVITY RANGE
+	# ==============================
+	sensitivityRange = f.calcRollingSensitivityAnalysis(newRollingSpillovers)
+
+	export = exportSensitivityRange(sensitivityRange,sectors,'grid',writer,chartFormat,maxPoints)
 	return sensitivityRange
 
 
 # ==================================================================================================
 # ===============================================MAIN===============================================
 # ==================================================================================================
-# ==============================
-# CHECK DIRECTORY
-# ==============================
-Path("output").mkdir(parents=True, exist_ok=True)
-Path("output/sensitivity_lag_order").mkdir(parents=True, exist_ok=True)
-Path("output/sensitivity_forecast_horizon").mkdir(parents=True, exist_ok=True)
-
-# AVERAGE
-print('Starting The Machine...')
-print('Calc Average Spillovers...')
-spilloversTable, setStats, volatility, lnvariance, lag_order, forecast_horizon = getAvgSpillovers()
-sectors = volatility.columns
-del spilloversTable, setStats, volatility, lnvariance
-print('End of Calc Average Spillovers')
-
-# ROLLING
-print('Calc Rolling Spillovers...')
-rollingSpillovers, temp1, temp2, temp3, temp4 = getRollingSpillovers(lag_order,forecast_horizon)
-export = exportRollingSpillovers(rollingSpillovers,sectors)
-del rollingSpillovers, temp1, temp2, temp3, temp4
-print('End of Calc Rolling Spillovers')
-
-# SENSITIVITY
-print('Calc Sensitivity Analysis Spillovers: lag_order...')
-sensitivityRange = getRollingSensitivityAnalysis('lag_order',min(1,math.floor(0.5*lag_order)),math.ceil(1.5*lag_order),lag_order,forecast_horizon,sectors)
-del sensitivityRange
-
-print('Calc Sensitivity Analysis Spillovers: forecast_horizon...')
-sensitivityRange = getRollingSensitivityAnalysis('forecast_horizon',min(1,math.floor(0.5*forecast_horizon)),math.ceil(1.5*forecast_horizon),lag_order,forecast_horizon,sectors)
-del sensitivityRange
-print('End of Calc Analysis Spillovers')
-
-print("End of Analysis")
\ No newline at end of file
+if __name__ == '__main__':
+	# ==============================
+	# CHECK DIRECTORY
+	# ==============================
+	Path("output").mkdir(parents=True, exist_ok=True)
+	Path("output/sensitivity_lag_order").mkdir(parents=True, exist_ok=True)
+	Path("output/sensitivity_forecast_horizon").mkdir(parents=True, exist_ok=True)
+	Path("output/sensitivity_rollingWindow").mkdir(parents=True, exist_ok=True)
+	Path("output/sensitivity_grid").mkdir(parents=True, exist_ok=True)
+	Path("output/_state").mkdir(parents=True, exist_ok=True)
+
+	# ==============================
+	# USER INPUT
+	# ==============================
+	userInput = pd.read_excel('_userInput.xlsx').set_index("SETTINGS")
+	chartFormat = getSetting(userInput,'chartFormat','PNG')
+	chartMaxPoints = getSetting(userInput,'chartMaxPoints',None)
+	spilloversModel = getSetting(userInput,'spilloversModel','Rolling')
+	rollingWindow = userInput.loc['rollingWindow','VALUE']
+	rollingWindow = 200 if rollingWindow =='Auto' else rollingWindow
+	sweepMode = getSetting(userInput,'sweepMode','Serial')
+	sweepQueueFolder = getSetting(userInput,'sweepQueueFolder','output\\_queue\\')
+	sweepLocalWorkers = getSetting(userInput,'sweepLocalWorkers',2)
+	sweepChunkSize = getSetting(userInput,'sweepChunkSize',50)
+	spilloversBackend = getSetting(userInput,'spilloversBackend','statsmodels')
+	# the units of the distributed sweep are rolling VAR windows, the TVP-VAR filter can not be split in chunks of dates
+	if sweepMode == 'Distributed' and spilloversModel == 'TVP-VAR':
+		raise ValueError('sweepMode Distributed is only available with spilloversModel Rolling, use sweepMode Serial with TVP-VAR')
+
+	# ==============================
+	# INTRADAY INGESTION
+	# ==============================
+	if getSetting(userInput,'dataSource','Daily') == 'Intraday':
+		print('Aggregate Intraday Data...')
+		getIntradayIngestion()
+
+	# ==============================
+	# BACKGROUND WRITER
+	# ==============================
+	# tables and charts of a finished stage are written while the next stage computes
+	writer = f.BackgroundWriter()
+
+	# AVERAGE
+	print('Starting The Machine...')
+	print('Calc Average Spillovers...')
+	spilloversTable, setStats, volatility, lnvariance, lag_order, forecast_horizon = getAvgSpillovers(writer=writer)
+	sectors = volatility.columns
+	del spilloversTable, setStats, volatility, lnvariance
+	print('End of Calc Average Spillovers')
+
+	# ROLLING
+	print('Calc Rolling Spillovers...')
+	rollingSpillovers, temp1, temp2, temp3, temp4 = getRollingSpillovers(lag_order,forecast_horizon,withStats=True)
+	export = exportRollingSpillovers(rollingSpillovers,sectors,writer,chartFormat,chartMaxPoints)
+
+	# NETWORK ANALYTICS
+	print('Calc Rolling Network Analytics...')
+	fevd, dates, networkSectors = f.calcRollingSpilloversTensor(rollingSpillovers)
+	networkAnalytics = f.calcNetworkAnalytics(fevd,dates,networkSectors)
+	export = exportNetworkAnalytics(networkAnalytics,writer,chartFormat,chartMaxPoints)
+	del fevd, dates, networkSectors, networkAnalytics
+
+	# ROLLING STATISTIC (the window statistics only exist in the rolling VAR)
+	if 'stats' in rollingSpillovers:
+		export = exportRollingStats(rollingSpillovers,writer,chartFormat,chartMaxPoints)
+	del rollingSpillovers, temp1, temp2, temp3, temp4
+	print('End of Calc Rolling Spillovers')
+
+	# SENSITIVITY
+	if sweepMode == 'Distributed':
+		print('Calc Sensitivity Analysis Spillovers: lag_order x forecast_horizon x rollingWindow...')
+		sensitivityRange = getDistributedSensitivityAnalysis( \
+			range(min(1,math.floor(0.5*lag_order)),math.ceil(1.5*lag_order)+1), \
+			range(min(1,math.floor(0.5*forecast_horizon)),math.ceil(1.5*forecast_horizon)+1), \
+			range(math.floor(0.5*rollingWindow),math.ceil(1.5*rollingWindow)+1,max(1,rollingWindow//4)), \
+			sectors,sweepQueueFolder,sweepLocalWorkers,sweepChunkSize, \
+			writer=writer,chartFormat=chartFormat,maxPoints=chartMaxPoints,backend=spilloversBackend \
+		)
+		del sensitivityRange
+	else:
+		print('Calc Sensitivity Analysis Spillovers: lag_order...')
+		sensitivityRange = getRollingSensitivityAnalysis('lag_order',min(1,math.floor(0.5*lag_order)),math.ceil(1.5*lag_order),lag_order,forecast_horizon,sectors,writer,chartFormat,chartMaxPoints)
+		del sensitivityRange
+
+		print('Calc Sensitivity Analysis Spillovers: forecast_horizon...')
+		sensitivityRange = getRollingSensitivityAnalysis('forecast_horizon',min(1,math.floor(0.5*forecast_horizon)),math.ceil(1.5*forecast_horizon),lag_order,forecast_horizon,sectors,writer,chartFormat,chartMaxPoints)
+		del sensitivityRange
+
+		# the rolling window length only exists in the rolling VAR
+		if spilloversModel != 'TVP-VAR':
+			print('Calc Sensitivity Analysis Spillovers: rollingWindow...')
+			sensitivityRange = getRollingSensitivityAnalysis('rollingWindow',math.floor(0.5*rollingWindow),math.ceil(1.5*rollingWindow),lag_order,forecast_horizon,sectors,writer,chartFormat,chartMaxPoints)
+			del sensitivityRange
+	print('End of Calc Analysis Spillovers')
+
+	print('Waiting For The Output Writer...')
+	writer.close()
+
+	print("End of Analysis")
@@ -0,0 +1,11 @@
+# Worker of the distributed sensitivity analysis (sweepMode = Distributed in _userInput.xlsx)
+# Run it on any machine that shares the queue folder with pySpillovers.py:
+# python pySweepWorker.py <queueFolder> [workerId]
+import sys
+import functions as f
+
+if __name__ == '__main__':
+	queueFolder = sys.argv[1]
+	workerId = sys.argv[2] if len(sys.argv) > 2 else None
+	f.runSweepWorker(queueFolder,workerId)
+	print('Sweep Worker Finished: no unit left in '+queueFolder)